@@ -2,9 +2,10 @@ import socket
 import threading
 import json
 import hashlib
-import datetime
+import hmac
 import time
 import os
+import queue
 import sys
 from colored import fg, attr # Keep for server-side coloring
 import sqlite3
@@ -15,16 +16,37 @@ PORT = 5050 # Make sure this matches the client's default
 DATABASE_FILE = "server_data.db" # Stores User Credentials
 OPS_FILE = "ops.json"  # File to store operators
 SERVER_PASSWORD = "SuperSecret"  # Change this to your desired server password
+SERVER_PASSWORD_BYTES = SERVER_PASSWORD.encode("utf-8")  # Encoded once for the constant-time comparison at login
 SERVER_NAME = "MyIRCServer"  # Change this to your desired server name
 FILE_DIRECTORY = "user_uploaded_files"  # Base directory for uploads
+CLIENT_RECV_SIZE = 8192  # Per-client receive buffer for recv_into(); commands are split on newlines and are far smaller
+MAX_LINE_BYTES = 65536  # A client line longer than this without a newline is handled as-is instead of buffered forever
+SOCKET_BUFFER_SIZE = 1 << 20  # Kernel SO_RCVBUF/SO_SNDBUF request (1 MiB); accepted sockets inherit it from the listener
+PASSWORD_HASH_ITERATIONS = 100_000  # PBKDF2-HMAC-SHA256 rounds for stored passwords (paid once per login)
+CLIENT_OUTBOX_SIZE = 50_000  # Messages queued per client before it counts as stalled and is disconnected; slots are cheap (recipients share each encoded message), so bursts fit
+WRITER_BATCH_SIZE = 64  # Most queued broadcasts a writer thread joins into one send
+WRITER_DRAIN_TIMEOUT = 2.0  # Seconds shutdown/restart wait in total for writers to flush their goodbye
+KEEPALIVE_IDLE = 60  # Seconds a connection may sit idle before the OS starts keepalive probes
+KEEPALIVE_INTERVAL = 10  # Seconds between keepalive probes
+KEEPALIVE_COUNT = 3  # Unanswered probes before the OS drops the connection
+TCP_USER_TIMEOUT_MS = 30_000  # Linux: drop the connection if sent data stays unacknowledged this long
+THREAD_STACK_SIZE = 512 * 1024  # Stack per login/client thread; handlers are shallow, so the 8 MiB OS default is mostly wasted
 
 # --- User Registration Control ---
 ALLOW_USER_AUTHENTICATION = True # Set to True to allow registration, False to disable
 
 # --- Utility Functions ---
+_clock = (None, "") # (whole second, its formatted text); one tuple so threads never see a torn pair
+
 def get_current_time():
-    """Returns the current time formatted as HH:MM:SS"""
-    return datetime.datetime.now().strftime("%X")
+    """Returns the current time formatted as HH:MM:SS, formatting at most once per second."""
+    global _clock
+    second = int(time.time())
+    cached_second, cached_text = _clock
+    if second != cached_second:
+        cached_text = time.strftime("%X", time.localtime(second))
+        _clock = (second, cached_text)
+    return cached_text
 
 # --- Database Initialization ---
 def initialize_database():
@@ -53,26 +75,31 @@ def initialize_database():
             conn.close()
 
 
+VALID_COLORS = frozenset(['black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white',
+                          'dark_gray', 'light_red', 'light_green', 'light_yellow', 'light_blue',
+                          'light_magenta', 'light_cyan'])
+_color_codes = {} # color -> (start code, reset code), looked up from `colored` once per color
+
 def color_text(text, color):
     """Applies color codes for server console output. Handles potential invalid colors."""
-    try:
-        valid_colors = ['black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white',
-                        'dark_gray', 'light_red', 'light_green', 'light_yellow', 'light_blue',
-                        'light_magenta', 'light_cyan']
-        if color in valid_colors or (isinstance(color, int) and 0 <= color <= 255):
-            return f"{fg(color)}{text}{attr('reset')}"
-        else:
-            print(f"[Color Warning] Unrecognized color '{color}' used. Falling back to white.")
-            return f"{fg('white')}{text}{attr('reset')}"
-    except Exception as e:
-        print(f"[Color Error] Error applying color '{color}': {e}. Falling back to plain text.")
-        return text
+    codes = _color_codes.get(color)
+    if codes is None:
+        try:
+            if color in VALID_COLORS or (isinstance(color, int) and 0 <= color <= 255):
+                codes = (fg(color), attr('reset'))
+            else:
+                print(f"[Color Warning] Unrecognized color '{color}' used. Falling back to white.")
+                codes = (fg('white'), attr('reset'))
+        except Exception as e:
+            print(f"[Color Error] Error applying color '{color}': {e}. Falling back to plain text.")
+            codes = ("", "")
+        _color_codes[color] = codes
+    return f"{codes[0]}{text}{codes[1]}"
 
 def format_for_client(message, prefix="[Server]"):
-    """Formats messages for sending to the client (no color)."""
+    """Formats messages for sending to the client (no color, newline-terminated for client-side framing)."""
     message_str = str(message) if not isinstance(message, str) else message
-    current_time_str = datetime.datetime.now().strftime("%X")
-    return f"{current_time_str} {prefix} {message_str}"
+    return f"{get_current_time()} {prefix} {message_str}\n"
 
 # --- File Handling ---
 if not os.path.exists(FILE_DIRECTORY):
@@ -90,12 +117,12 @@ def handle_upload(client_socket, filepath, username):
         os.makedirs(user_dir, exist_ok=True)
 
         if not os.path.exists(filepath):
-            client_socket.send(format_for_client(f"Source file '{os.path.basename(filepath)}' not found on server.", "[Error]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client(f"Source file '{os.path.basename(filepath)}' not found on server.", "[Error]").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Upload Error] {username} requested non-existent source file: {filepath}", "red"))
             return
 
         if not os.path.isfile(filepath):
-            client_socket.send(format_for_client(f"Source path '{os.path.basename(filepath)}' is not a file.", "[Error]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client(f"Source path '{os.path.basename(filepath)}' is not a file.", "[Error]").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Upload Error] {username} requested source path is not a file: {filepath}", "red"))
             return
 
@@ -104,12 +131,12 @@ def handle_upload(client_socket, filepath, username):
 
         invalid_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|']
         if ".." in filename or any(char in filename for char in invalid_chars):
-            client_socket.send(format_for_client("Invalid filename provided.", "[Error]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client("Invalid filename provided.", "[Error]").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Upload Error] {username} attempted invalid filename: {filename}", "red"))
             return
 
         if os.path.exists(dest_path):
-            client_socket.send(format_for_client(f"File '{filename}' already exists in your server directory. Upload failed.", "[Error]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client(f"File '{filename}' already exists in your server directory. Upload failed.", "[Error]").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Upload Error] {username} attempted to overwrite existing file: {filename}", "yellow"))
             return
 
@@ -119,15 +146,15 @@ def handle_upload(client_socket, filepath, username):
                 dest_file.write(data)
                 copied_bytes += len(data)
 
-        client_socket.send(format_for_client(f"File '{filename}' uploaded successfully to your server directory.", "[Info]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client(f"File '{filename}' uploaded successfully to your server directory.", "[Info]").encode("utf-8"))
         broadcast(format_for_client(f"{username} uploaded a file.", "[Info]"), None)
         print(color_text(f"{get_current_time()} [Upload] {username} uploaded '{filename}' ({copied_bytes} bytes) successfully.", "green"))
 
     except PermissionError as e:
-        client_socket.send(format_for_client(f"Server permission error during upload.", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client(f"Server permission error during upload.", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} [Upload Error] Permission denied for {username} ({filepath}): {str(e)}", "red"))
     except Exception as e:
-        client_socket.send(format_for_client(f"Error uploading file: Check server logs.", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client(f"Error uploading file: Check server logs.", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} [Upload Error] Failed for {username} ({filepath}): {str(e)}", "red"))
 
 
@@ -138,7 +165,7 @@ def handle_download(client_socket, target_username, filename, requestor_username
 
     invalid_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|']
     if ".." in filename or any(char in filename for char in invalid_chars):
-        client_socket.send(format_for_client("Invalid filename requested.", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client("Invalid filename requested.", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} [Download Error] {requestor_username} attempted invalid filename: {filename}", "red"))
         return
 
@@ -147,42 +174,48 @@ def handle_download(client_socket, target_username, filename, requestor_username
         abs_filepath = os.path.abspath(filepath)
 
         if not abs_filepath.startswith(abs_user_dir):
-            client_socket.send(format_for_client(f"Error: File access denied.", "[Error]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client(f"Error: File access denied.", "[Error]").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Download Error] {requestor_username} attempted directory traversal: {filename}", "red"))
             return
 
         if not os.path.exists(filepath) or not os.path.isfile(filepath):
-            client_socket.send(format_for_client(f"Error: File '{filename}' not found in {target_username}'s directory.", "[Error]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client(f"Error: File '{filename}' not found in {target_username}'s directory.", "[Error]").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Download Error] {requestor_username} requested non-existent file: {target_username}/{filename}", "yellow"))
             return
 
-        file_size = os.path.getsize(filepath)
-        header = f"FILE_TRANSFER:{filename}:{file_size}"
-        client_socket.send(header.encode("utf-8"))
-        print(color_text(f"{get_current_time()} [Download] Sending '{filename}' ({file_size} bytes) from {target_username} to {requestor_username}.", "yellow"))
+        file = open(filepath, "rb") # Opened here so a missing file is reported below; the writer thread streams it
+        file_size = os.fstat(file.fileno()).st_size
+        header = f"FILE_TRANSFER:{filename}:{file_size}\n"
+
+        def stream_file(sock):
+            """Runs on the client's writer thread, so no queued message lands inside the file bytes."""
+            with file:
+                sock.sendall(header.encode("utf-8")) # Clients take file bytes that arrive with the header from their buffer
+                bytes_sent = 0
+                while True:
+                    data = file.read(4096)
+                    if not data:
+                        break
+                    sock.sendall(data)
+                    bytes_sent += len(data)
+            print(color_text(f"{get_current_time()} [Download] File '{filename}' ({bytes_sent} bytes) sent successfully to {requestor_username}.", "green"))
 
-        time.sleep(0.1)
-
-        bytes_sent = 0
-        with open(filepath, "rb") as file:
-            while True:
-                data = file.read(4096)
-                if not data:
-                    break
-                client_socket.sendall(data)
-                bytes_sent += len(data)
-
-        print(color_text(f"{get_current_time()} [Download] File '{filename}' ({bytes_sent} bytes) sent successfully to {requestor_username}.", "green"))
+        print(color_text(f"{get_current_time()} [Download] Sending '{filename}' ({file_size} bytes) from {target_username} to {requestor_username}.", "yellow"))
+        try:
+            send_to_client(client_socket, stream_file)
+        except OSError:
+            file.close()
+            raise
 
     except FileNotFoundError:
-        client_socket.send(format_for_client(f"Error: File '{filename}' not found during read.", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client(f"Error: File '{filename}' not found during read.", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} [Download Error] File disappeared during download?: {target_username}/{filename}", "red"))
     except ConnectionAbortedError:
         print(color_text(f"{get_current_time()} [Download Info] Connection aborted by {requestor_username} during download of {filename}.", "yellow"))
     except ConnectionResetError:
         print(color_text(f"{get_current_time()} [Download Info] Connection reset by {requestor_username} during download of {filename}.", "yellow"))
     except Exception as e:
-        client_socket.send(format_for_client(f"Error downloading file. Check server logs.", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client(f"Error downloading file. Check server logs.", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} [Download Error] Failed sending {filename} to {requestor_username}: {str(e)}", "red"))
 
 def handle_list_files(client_socket, target_username, requestor_username):
@@ -193,28 +226,28 @@ def handle_list_files(client_socket, target_username, requestor_username):
 
     try:
         if not os.path.exists(user_dir) or not os.path.isdir(user_dir):
-            client_socket.send(file_list_message_prefix.encode("utf-8"))
+            send_to_client(client_socket, (file_list_message_prefix + "\n").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Files] Directory not found for {target_username}, requested by {requestor_username}. Sent empty list.", "yellow"))
             return
 
         files = [f for f in os.listdir(user_dir) if os.path.isfile(os.path.join(user_dir, f)) and f]
 
         if not files:
-            client_socket.send(file_list_message_prefix.encode("utf-8"))
+            send_to_client(client_socket, (file_list_message_prefix + "\n").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Files] No files found for {target_username}, requested by {requestor_username}. Sent empty list.", "yellow"))
         else:
             files_str = ";".join(files)
-            full_message = file_list_message_prefix + files_str
-            client_socket.send(full_message.encode("utf-8"))
+            full_message = file_list_message_prefix + files_str + "\n"
+            send_to_client(client_socket, full_message.encode("utf-8"))
             print(color_text(f"{get_current_time()} [Files] Sent file list for {target_username} to {requestor_username} ({len(files)} files).", "green"))
 
     except PermissionError as e:
         error_msg = format_for_client(f"Server permission error listing files for {target_username}.", "[Error]")
-        client_socket.send(error_msg.encode("utf-8"))
+        send_to_client(client_socket, error_msg.encode("utf-8"))
         print(color_text(f"{get_current_time()} [Files Error] Permission denied listing for {target_username} (requested by {requestor_username}): {str(e)}", "red"))
     except Exception as e:
         error_msg = format_for_client(f"Error retrieving file list for {target_username}. Check server logs.", "[Error]")
-        client_socket.send(error_msg.encode("utf-8"))
+        send_to_client(client_socket, error_msg.encode("utf-8"))
         print(color_text(f"{get_current_time()} [Files Error] Failed listing for {target_username} (requested by {requestor_username}): {str(e)}", "red"))
 
 # --- File Deletion Handling ---
@@ -233,7 +266,7 @@ def handle_delete_file(client_socket, username, command_parts):
     # --- Case 2: /delete <target_user> <filename> (OP deletes other's file) ---
     elif len(command_parts) == 3:
         if not is_op:
-            client_socket.send(format_for_client("Permission denied. Only Operators can delete other users' files.", "[Error]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client("Permission denied. Only Operators can delete other users' files.", "[Error]").encode("utf-8"))
             print(color_text(f"{get_current_time()} [Delete Attempt] Non-OP {username} tried to delete file from {command_parts[1]}", "red"))
             return
         target_user = command_parts[1]
@@ -242,13 +275,13 @@ def handle_delete_file(client_socket, username, command_parts):
     # --- Invalid format ---
     else:
         usage = "Usage: /delete <filename>  OR  /delete <target_user> <filename> (Operator only)"
-        client_socket.send(format_for_client(usage, "[Usage]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client(usage, "[Usage]").encode("utf-8"))
         return
 
     # --- Validate filename ---
     invalid_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|']
     if ".." in filename or any(char in filename for char in invalid_chars):
-        client_socket.send(format_for_client("Invalid filename provided.", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client("Invalid filename provided.", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} {print_prefix} {username} attempted invalid filename: {filename}", "red"))
         return
 
@@ -260,7 +293,7 @@ def handle_delete_file(client_socket, username, command_parts):
 
     # Extra security check: Ensure path is within the intended user directory
     if not abs_filepath.startswith(abs_user_dir):
-        client_socket.send(format_for_client("Error: File access denied (path violation).", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client("Error: File access denied (path violation).", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} {print_prefix} {username} attempted directory traversal delete: {filename}", "red"))
         return
 
@@ -272,24 +305,24 @@ def handle_delete_file(client_socket, username, command_parts):
                 success_msg += f" from user '{target_user}'s directory"
             success_msg += "."
 
-            client_socket.send(format_for_client(success_msg, "[Info]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client(success_msg, "[Info]").encode("utf-8"))
             print(color_text(f"{get_current_time()} {print_prefix} {username} deleted file '{target_user}/{filename}'.", "green"))
             # Optionally notify the owner if an OP deleted their file (might be noisy)
             # if is_op and target_user != username:
             #     target_sock = find_socket_by_username(target_user)
             #     if target_sock:
             #         try:
-            #             target_sock.send(format_for_client(f"Operator '{username}' deleted your file: '{filename}'", "[Warning]").encode("utf-8"))
+            #             target_sock.sendall(format_for_client(f"Operator '{username}' deleted your file: '{filename}'", "[Warning]").encode("utf-8"))
             #         except: pass
         else:
-            client_socket.send(format_for_client(f"Error: File '{filename}' not found in '{target_user}'s directory.", "[Error]").encode("utf-8"))
+            send_to_client(client_socket, format_for_client(f"Error: File '{filename}' not found in '{target_user}'s directory.", "[Error]").encode("utf-8"))
             print(color_text(f"{get_current_time()} {print_prefix} {username} tried to delete non-existent file: {target_user}/{filename}", "yellow"))
 
     except PermissionError:
-        client_socket.send(format_for_client(f"Server permission error deleting file '{filename}'.", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client(f"Server permission error deleting file '{filename}'.", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} {print_prefix} Permission denied deleting {target_user}/{filename} for {username}", "red"))
     except Exception as e:
-        client_socket.send(format_for_client(f"Error deleting file '{filename}'. Check server logs.", "[Error]").encode("utf-8"))
+        send_to_client(client_socket, format_for_client(f"Error deleting file '{filename}'. Check server logs.", "[Error]").encode("utf-8"))
         print(color_text(f"{get_current_time()} {print_prefix} Failed deleting {target_user}/{filename} for {username}: {str(e)}", "red"))
 
 
@@ -314,32 +347,187 @@ def save_ops(ops_list):
          print(color_text(f"{get_current_time()} [Error] Unexpected error saving ops: {e}", "red"))
 
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+def hash_password(password, salt=None, iterations=PASSWORD_HASH_ITERATIONS):
+    """Returns a salted PBKDF2 hash stored as 'pbkdf2_sha256$iterations$salt$hash'."""
+    if salt is None:
+        salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+def verify_password(password, stored_hash):
+    """Checks a password against a stored hash; also accepts legacy unsalted SHA-256 hashes."""
+    if stored_hash.startswith("pbkdf2_sha256$"):
+        try:
+            _, iterations, salt_hex, _ = stored_hash.split("$")
+            attempt = hash_password(password, bytes.fromhex(salt_hex), int(iterations))
+        except ValueError:
+            return False # Malformed stored hash
+        return hmac.compare_digest(attempt, stored_hash)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored_hash)
 
 # --- Global Variables ---
 initialize_database()
 ops = load_ops()
 clients = {} # {client_socket: username}
+client_sockets_by_name = {} # {username: client_socket}, the reverse index of `clients` for O(1) presence checks and kicks
+client_outboxes = {} # {client_socket: queue.Queue} of encoded broadcasts, drained by that client's writer thread
+client_writers = {} # {client_socket: threading.Thread} writer threads, joined on shutdown so goodbyes get flushed
+clients_snapshot = () # Tuple of (client_socket, outbox) for broadcast(); rebuilt on join/leave instead of copied per message
 lock = threading.RLock() # RE-ENTRANT Lock for synchronizing access to shared resources
 server_socket = None # Will be initialized in server()
 
 # --- Client Handling Logic ---
+def refresh_clients_snapshot():
+    """Rebuilds clients_snapshot after `clients` changed. Call with `lock` held."""
+    global clients_snapshot
+    clients_snapshot = tuple(client_outboxes.items())
+
+def shutdown_socket(client_socket):
+    """Shuts down both directions, waking any thread blocked in recv()/sendall() on the socket."""
+    try: client_socket.shutdown(socket.SHUT_RDWR)
+    except OSError: pass
+
+def client_writer(client_socket, outbox):
+    """
+    Sends everything queued for one client, in order, so a slow receiver only delays itself.
+    Items are encoded bytes, callables taking the socket (e.g. a file stream), or None to stop.
+    """
+    stopping = False
+    while not stopping:
+        batch = [outbox.get()]
+        # Anything that queued up meanwhile goes out in the same send (one syscall, not one per message)
+        while len(batch) < WRITER_BATCH_SIZE:
+            try: batch.append(outbox.get_nowait())
+            except queue.Empty: break
+        if None in batch: # Client was removed; send what came before the marker, then stop
+            batch = batch[:batch.index(None)]
+            stopping = True
+        try:
+            pending = []
+            for item in batch:
+                if callable(item):
+                    if pending: # Flush earlier bytes first so the callable's output stays in order
+                        client_socket.sendall(b"".join(pending))
+                        pending.clear()
+                    item(client_socket)
+                else:
+                    pending.append(item)
+            if pending:
+                client_socket.sendall(b"".join(pending))
+        except OSError:
+            # Wake the client's handler thread so it runs the normal disconnect cleanup
+            shutdown_socket(client_socket)
+            return
+
+def add_client(client_socket, username):
+    """Registers a logged-in client and starts its writer thread. Call with `lock` held."""
+    outbox = queue.Queue(maxsize=CLIENT_OUTBOX_SIZE)
+    clients[client_socket] = username
+    client_sockets_by_name[username] = client_socket
+    client_outboxes[client_socket] = outbox
+    refresh_clients_snapshot()
+    writer = threading.Thread(target=client_writer, args=(client_socket, outbox), name=f"Writer-{username}", daemon=True)
+    client_writers[client_socket] = writer
+    writer.start()
+
+def remove_client(client_socket, default=None, goodbye=None):
+    """
+    Unregisters a client and stops its writer thread; returns its username. Call with `lock` held.
+    If `goodbye` (bytes) is given, the writer sends it after what's already queued and then shuts the socket down.
+    """
+    username = clients.pop(client_socket, default)
+    if client_sockets_by_name.get(username) is client_socket:
+        del client_sockets_by_name[username]
+    client_writers.pop(client_socket, None)
+    outbox = client_outboxes.pop(client_socket, None)
+    if outbox is not None:
+        try:
+            if goodbye is not None:
+                outbox.put_nowait(goodbye)
+                outbox.put_nowait(shutdown_socket)
+            outbox.put_nowait(None) # Writer stops after sending what's already queued
+        except queue.Full:
+            shutdown_socket(client_socket) # Writer may be stuck in sendall(); this makes it fail and exit
+        refresh_clients_snapshot()
+    elif goodbye is not None:
+        shutdown_socket(client_socket)
+    return username
+
+def send_to_client(client_socket, data):
+    """
+    Queues bytes (or a callable taking the socket) behind everything already queued for a logged-in client,
+    so direct replies and broadcasts reach it in a defined order. Never blocks: if its outbox is full the
+    client is shut down (its handler thread then cleans up) and ConnectionError is raised.
+    """
+    outbox = client_outboxes.get(client_socket)
+    if outbox is None: # No writer (client already removed): send from this thread
+        if callable(data): data(client_socket)
+        else: client_socket.sendall(data)
+        return
+    try:
+        outbox.put_nowait(data)
+    except queue.Full:
+        shutdown_socket(client_socket)
+        raise ConnectionError("client is not reading its messages") from None
+
+def disconnect_all_clients(goodbye_message):
+    """
+    Unregisters every client, has its writer send `goodbye_message` after what's already queued, and waits
+    up to WRITER_DRAIN_TIMEOUT in total for the writers before closing the sockets. Returns how many were closed.
+    """
+    goodbye = goodbye_message.encode("utf-8")
+    with lock:
+        departing = [(sock, client_writers.get(sock)) for sock in clients]
+        for sock, _ in departing: remove_client(sock, goodbye=goodbye) # Prevent new messages during shutdown
+    deadline = time.monotonic() + WRITER_DRAIN_TIMEOUT
+    for sock, writer in departing:
+        if writer is not None:
+            writer.join(max(0.0, deadline - time.monotonic()))
+        shutdown_socket(sock) # No-op if the writer already did it; otherwise unblocks a stuck writer
+        try: sock.close()
+        except OSError: pass
+    return len(departing)
+
+def recv_line(client_socket, buffer, recv_view):
+    """
+    Returns the next newline-terminated line from the client (newline removed), or None on disconnect.
+    TCP doesn't keep message boundaries, so bytes after the newline stay in `buffer` for the next call.
+    `recv_view` is the connection's reusable receive buffer, so reading doesn't allocate a new bytes object.
+    """
+    while True:
+        newline = buffer.find(b"\n")
+        if newline != -1:
+            line = buffer[:newline] # One copy; callers only decode it
+            del buffer[:newline + 1]
+            return line
+        if len(buffer) > MAX_LINE_BYTES:
+            line = buffer[:]
+            buffer.clear()
+            return line
+        received = client_socket.recv_into(recv_view)
+        if not received:
+            return None
+        buffer += recv_view[:received]
+
 def handle_client(client_socket, username):
     """Handles messages and commands from a single connected client."""
     print(color_text(f"{get_current_time()} [Thread] Started handler thread for {username}.", "blue"))
+    pending = bytearray() # Received bytes not yet split into lines
+    recv_view = memoryview(bytearray(CLIENT_RECV_SIZE)) # Reused for every recv_into() on this connection
     while True:
         try:
-            message_bytes = client_socket.recv(2048)
-            if not message_bytes:
+            message_bytes = recv_line(client_socket, pending, recv_view)
+            if message_bytes is None:
                 print(color_text(f"{get_current_time()} [Connection] Received empty data from {username}, assuming disconnect.", "yellow"))
                 break
+            if client_socket not in clients:
+                continue # Kicked or shutting down: ignore input until the writer sends the goodbye and shuts the socket down
 
             try:
                 message = message_bytes.decode("utf-8")
             except UnicodeDecodeError:
                 print(color_text(f"{get_current_time()} [Error] Received non-UTF8 data from {username}. Disconnecting.", "red"))
-                try: client_socket.send(format_for_client("Invalid data received. Disconnecting.", "[Error]").encode("utf-8"))
+                try: send_to_client(client_socket, format_for_client("Invalid data received. Disconnecting.", "[Error]").encode("utf-8"))
                 except: pass
                 break
 
@@ -357,7 +545,7 @@ def handle_client(client_socket, username):
                 # == File Commands ==
                 if command == "/upload":
                     if len(msg_content.split(" ", 1)) < 2:
-                         client_socket.send(format_for_client("Usage: /upload <server_source_filepath>", "[Usage]").encode("utf-8"))
+                         send_to_client(client_socket, format_for_client("Usage: /upload <server_source_filepath>", "[Usage]").encode("utf-8"))
                     else:
                          server_source_path = msg_content.split(" ", 1)[1] # Get everything after /upload
                          server_source_path = server_source_path.strip('"') # Basic quote stripping
@@ -367,7 +555,7 @@ def handle_client(client_socket, username):
                 elif command == "/download":
                     parts = msg_content.split(" ", 2) # /download user filename
                     if len(parts) < 3:
-                         client_socket.send(format_for_client("Usage: /download <username> <filename>", "[Usage]").encode("utf-8"))
+                         send_to_client(client_socket, format_for_client("Usage: /download <username> <filename>", "[Usage]").encode("utf-8"))
                     else:
                          target_user = parts[1]
                          filename = parts[2].strip('"') # Basic quote stripping
@@ -376,7 +564,7 @@ def handle_client(client_socket, username):
                 elif command == "/files":
                     parts = msg_content.split(" ", 1) # /files username
                     if len(parts) < 2:
-                        client_socket.send(format_for_client("Usage: /files <username>", "[Usage]").encode("utf-8"))
+                        send_to_client(client_socket, format_for_client("Usage: /files <username>", "[Usage]").encode("utf-8"))
                     else:
                         target_user = parts[1]
                         handle_list_files(client_socket, target_user, username)
@@ -395,7 +583,7 @@ def handle_client(client_socket, username):
                     with lock:
                         is_op = username in ops
                     if not is_op:
-                        client_socket.send(format_for_client("You do not have permission to execute this command.", "[Error]").encode("utf-8"))
+                        send_to_client(client_socket, format_for_client("You do not have permission to execute this command.", "[Error]").encode("utf-8"))
                     else:
                         # Pass the raw message content for more flexible parsing inside handle_server_command
                         handle_server_command(client_socket, username, msg_content)
@@ -406,7 +594,7 @@ def handle_client(client_socket, username):
                         user_list_sorted = sorted(list(clients.values()))
                         user_list_str = ", ".join(user_list_sorted)
                         num_users = len(clients)
-                    client_socket.send(format_for_client(f"Connected users ({num_users}): {user_list_str}", "[Users]").encode("utf-8"))
+                    send_to_client(client_socket, format_for_client(f"Connected users ({num_users}): {user_list_str}", "[Users]").encode("utf-8"))
 
                 elif command == "/help":
                     # --- UPDATED Help Text ---
@@ -429,20 +617,20 @@ Operator Commands (require OP status):
   /stop               Stop the server (console only recommended)
   /restart            Restart the server (console only recommended)
 """
-                    client_socket.send(help_text.encode("utf-8")) # Send raw help text
+                    send_to_client(client_socket, help_text.encode("utf-8")) # Send raw help text
 
                 elif command == "/exit":
                     print(color_text(f"{get_current_time()} [Connection] {username} sent /exit command.", "yellow"))
                     break
 
                 else:
-                    client_socket.send(format_for_client(f"Unknown command: {command}", "[Error]").encode("utf-8"))
+                    send_to_client(client_socket, format_for_client(f"Unknown command: {command}", "[Error]").encode("utf-8"))
 
             # --- Regular Message Handling ---
             else:
                 if len(msg_content) > 512:
                     print(color_text(f"{get_current_time()} {username} sent a message that is too long: {len(msg_content)} chars", "yellow"))
-                    client_socket.send(format_for_client("Message cannot exceed 512 characters.", "[Error]").encode("utf-8"))
+                    send_to_client(client_socket, format_for_client("Message cannot exceed 512 characters.", "[Error]").encode("utf-8"))
                     continue
 
                 formatted_print_msg = f"{get_current_time()} [{color_text(username, 'cyan')}]: {msg_content}"
@@ -466,7 +654,7 @@ Operator Commands (require OP status):
         except Exception as e:
             print(color_text(f"{get_current_time()} [Error] Unexpected error handling client {username}: {e}", "red"))
             try:
-                client_socket.send(format_for_client("An internal server error occurred.", "[Error]").encode("utf-8"))
+                send_to_client(client_socket, format_for_client("An internal server error occurred.", "[Error]").encode("utf-8"))
             except: pass
             break
 
@@ -474,7 +662,7 @@ Operator Commands (require OP status):
     disconnected_user = None
     with lock:
         if client_socket in clients:
-            disconnected_user = clients.pop(client_socket, None)
+            disconnected_user = remove_client(client_socket)
 
     if disconnected_user:
         print(color_text(f"{get_current_time()} [Disconnect] {disconnected_user} disconnected.", "red"))
@@ -515,52 +703,34 @@ def handle_server_command(client_socket, issuer_username, message):
     notify_target_msg = "" # Message for the user being opped/deopped
     log_msg = ""           # Message for server log
     target_user = ""     # Define target_user outside conditional blocks
+    reply_msg = ""       # Message for the issuer (kick/listops), sent once the lock is released
+    final_broadcast = "" # /stop or /restart warning, broadcast once the lock is released
+    final_action = None  # shutdown_server or restart_server, scheduled after final_broadcast
 
     # Use lock for commands modifying shared state (clients, ops, user_credentials read)
     with lock:
         if command == "/kick":
             # --- KICK LOGIC ---
-            if len(parts) < 2:
-                client_socket.send(format_for_client("Usage: /kick <username> [reason]", "[Usage]").encode("utf-8"))
-                return
-
-            target_user = parts[1]
+            target_user = parts[1] if len(parts) > 1 else ""
             reason = parts[2] if len(parts) > 2 else "No reason specified."
+            target_socket_kick = client_sockets_by_name.get(target_user)
 
-            if target_user == issuer_username:
-                client_socket.send(format_for_client("You cannot kick yourself.", "[Error]").encode("utf-8"))
-                return
-
-            target_socket_kick = None
-            for sock, user in clients.items():
-                if user == target_user:
-                    target_socket_kick = sock
-                    break
-
-            if target_socket_kick:
+            if len(parts) < 2:
+                reply_msg = format_for_client("Usage: /kick <username> [reason]", "[Usage]")
+            elif target_user == issuer_username:
+                reply_msg = format_for_client("You cannot kick yourself.", "[Error]")
+            elif target_socket_kick:
                 kick_message = format_for_client(f"You have been kicked by {issuer_username}. Reason: {reason}", "[Kick]")
-                try:
-                    target_socket_kick.send(kick_message.encode("utf-8"))
-                    # Give a moment for the message to potentially send before shutting down
-                    time.sleep(0.1)
-                    target_socket_kick.shutdown(socket.SHUT_RDWR)
-                except OSError as e:
-                    print(color_text(f"{get_current_time()} [Kick Error] Error sending kick/shutting down socket for {target_user}: {e} (client may have already disconnected)", "red"))
-                except Exception as e:
-                    print(color_text(f"{get_current_time()} [Kick Error] Unexpected error during kick socket handling for {target_user}: {e}", "red"))
-                finally:
-                    # Ensure removal happens even if send/shutdown fails
-                    clients.pop(target_socket_kick, None) # Use pop with default None
-                    try:
-                        target_socket_kick.close() # Attempt close as well
-                    except: pass # Ignore errors closing already potentially broken socket
+                # Non-blocking: the target's writer sends the kick message and shuts the socket down,
+                # and its handler thread closes it once recv() wakes
+                remove_client(target_socket_kick, goodbye=kick_message.encode("utf-8"))
 
                 kick_success = True # Set kick flag
                 broadcast_msg = format_for_client(f"{target_user} was kicked by {issuer_username}. Reason: {reason}", "[Info]")
                 log_msg = f"[Kick] {issuer_username} kicked {target_user}. Reason: {reason}" # Log message for outside lock
 
             else: # Target user not found
-                client_socket.send(format_for_client(f"User '{target_user}' not found online.", "[Error]").encode("utf-8"))
+                reply_msg = format_for_client(f"User '{target_user}' not found online.", "[Error]")
                 kick_success = False
             # --- END KICK LOGIC ---
 
@@ -612,10 +782,7 @@ def handle_server_command(client_socket, issuer_username, message):
                         log_msg = f"[DEOP] {issuer_username} de-opped {target_user}."
                         notify_target_msg = format_for_client(f"Your Operator status has been removed by {issuer_username}.", "[Info]")
                         # Find the target socket to notify (if online)
-                        for sock, user in clients.items():
-                            if user == target_user:
-                                notify_target_sock = sock
-                                break
+                        notify_target_sock = client_sockets_by_name.get(target_user)
                     except ValueError:
                         # Should be rare because of the 'not in ops' check, but handle defensively
                         op_change_msg = format_for_client(f"Error: Could not remove '{target_user}' from operators list (internal state mismatch?).", "[Error]")
@@ -628,24 +795,22 @@ def handle_server_command(client_socket, issuer_username, message):
              # --- LISTOPS LOGIC (Existing) ---
              op_list_sorted = sorted(ops)
              op_list_str = ", ".join(op_list_sorted) if op_list_sorted else "No operators defined."
-             client_socket.send(format_for_client(f"Current Operators: {op_list_str}", "[Ops]").encode("utf-8"))
+             reply_msg = format_for_client(f"Current Operators: {op_list_str}", "[Ops]")
              print(color_text(f"{get_current_time()} [Info] {issuer_username} listed operators.", "yellow"))
              # --- END LISTOPS LOGIC ---
 
         elif command == "/stop":
             # --- STOP LOGIC (Existing) ---
             print(color_text(f"{get_current_time()} [Shutdown] Server stop initiated by OP {issuer_username}.", "red"))
-            broadcast(format_for_client(f"Server is shutting down NOW! (Issued by {issuer_username})", "[Warning]"), None)
-            # Schedule shutdown slightly later to allow broadcast message to go out
-            threading.Timer(0.5, shutdown_server).start()
+            final_broadcast = format_for_client(f"Server is shutting down NOW! (Issued by {issuer_username})", "[Warning]")
+            final_action = shutdown_server
             # --- END STOP LOGIC ---
 
         elif command == "/restart":
             # --- RESTART LOGIC (Existing) ---
             print(color_text(f"{get_current_time()} [Restart] Server restart initiated by OP {issuer_username}.", "red"))
-            broadcast(format_for_client(f"Server is restarting NOW! (Issued by {issuer_username})", "[Warning]"), None)
-            # Schedule restart slightly later
-            threading.Timer(0.5, restart_server).start()
+            final_broadcast = format_for_client(f"Server is restarting NOW! (Issued by {issuer_username})", "[Warning]")
+            final_action = restart_server
             # --- END RESTART LOGIC ---
 
          # Note: No 'else' needed here as the command validity was checked in handle_client
@@ -656,22 +821,31 @@ def handle_server_command(client_socket, issuer_username, message):
     if op_needs_save:
         save_ops(ops) # Call save function which handles its own locking
 
+    # Send kick/listops reply to the issuer
+    if reply_msg:
+        send_to_client(client_socket, reply_msg.encode("utf-8"))
+
     # Send kick broadcast message if kick was successful
     if kick_success and broadcast_msg:
         print(color_text(f"{get_current_time()} {log_msg}", "red")) # Log kick action
         broadcast(broadcast_msg, None) # Inform everyone
 
+    # Warn everyone, then stop/restart; the warning is queued ahead of each client's goodbye
+    if final_action:
+        broadcast(final_broadcast, None)
+        threading.Timer(0.5, final_action).start()
+
     # Send op/deop confirmation to issuer
     if op_change_msg:
         try:
-            client_socket.send(op_change_msg.encode("utf-8"))
+            send_to_client(client_socket, op_change_msg.encode("utf-8"))
         except Exception as e:
              print(color_text(f"{get_current_time()} [Error] Failed to send op/deop confirmation to {issuer_username}: {e}", "yellow"))
 
     # Send notification to the target user if op/deop succeeded and they are online
     if op_changed and notify_target_sock and notify_target_msg:
         try:
-            notify_target_sock.send(notify_target_msg.encode("utf-8"))
+            send_to_client(notify_target_sock, notify_target_msg.encode("utf-8"))
         except Exception as e:
              # Need to access target_user variable here, ensure it's defined
              # If op/deop logic ensures target_user is set when op_changed is True, this is fine.
@@ -686,29 +860,18 @@ def handle_server_command(client_socket, issuer_username, message):
 def broadcast(message, sender_socket):
     """Sends a message (already formatted, no color) to all clients except the sender."""
     disconnected_sockets = []
-    with lock:
-        # Create a copy of the keys to iterate over, avoiding modification issues
-        current_clients = list(clients.keys())
-
-    for client in current_clients:
-        if client == sender_socket: continue
+    data = message.encode("utf-8") # Encode once; every recipient gets the same bytes
+    # Immutable tuple swapped in on join/leave; reading the global is atomic, so no copy or lock here
+    for client, outbox in clients_snapshot:
+        if client is sender_socket: continue
         try:
-            # Using sendall for potentially larger messages like broadcasts
-            client.sendall(message.encode("utf-8"))
-        except (ConnectionResetError, BrokenPipeError, OSError) as e:
-            # Common errors indicating client disconnected abruptly
-            # Retrieve username *before* potentially removing the socket
-            temp_username = "Unknown (lookup failed)"
+            # Hand off to the client's writer thread; never waits, so a stalled recipient can't slow the sender
+            outbox.put_nowait(data)
+        except queue.Full:
+            # Client stopped reading: CLIENT_OUTBOX_SIZE messages are waiting for it
             with lock: # Briefly re-acquire lock for safe lookup
                 temp_username = clients.get(client, 'Unknown (disconnected)')
-            print(color_text(f"{get_current_time()} [Broadcast Info] Client {temp_username} disconnected during broadcast: {e}. Marking for removal.", "yellow"))
-            disconnected_sockets.append(client)
-        except Exception as e:
-            # Log unexpected errors, but try to get username if possible (might fail if client gone)
-            client_username = "Unknown (lookup failed)"
-            with lock: # Briefly re-acquire lock for safe lookup
-                 client_username = clients.get(client, 'Unknown (error)')
-            print(color_text(f"{get_current_time()} [Broadcast Error] Unexpected error sending to client {client_username}: {e}. Marking for removal.", "red"))
+            print(color_text(f"{get_current_time()} [Broadcast Info] Client {temp_username} is not keeping up with broadcasts. Marking for removal.", "yellow"))
             disconnected_sockets.append(client)
 
     # Cleanup disconnected sockets outside the iteration loop
@@ -717,13 +880,15 @@ def broadcast(message, sender_socket):
         with lock:
             for sock in disconnected_sockets:
                 if sock in clients: # Check if still exists before removing (e.g., handled by client thread already)
-                    disconnected_user = clients.pop(sock, 'Unknown (cleanup)')
+                    disconnected_user = remove_client(sock, 'Unknown (cleanup)')
                     print(color_text(f"{get_current_time()} [Broadcast Cleanup] Removing disconnected client: {disconnected_user}", "yellow"))
+                    shutdown_socket(sock) # Makes its writer's blocked sendall() fail so the thread exits
                     try: sock.close() # Close socket during cleanup
                     except: pass # Ignore errors closing already broken socket
                 else:
                     # Socket might have already been removed by its handler thread, just try closing
                     print(color_text(f"{get_current_time()} [Broadcast Cleanup] Socket already removed, attempting close anyway.", "blue"))
+                    shutdown_socket(sock)
                     try: sock.close()
                     except: pass
 
@@ -740,18 +905,18 @@ def handle_login(client_socket, addr):
     print(color_text(f"{get_current_time()} [Auth] Connection attempt from {addr}", "blue"))
     try:
         # --- Server Password Check ---
-        client_socket.send(b"Enter server password: ")
+        client_socket.sendall(b"Enter server password: \n")
         client_socket.settimeout(30) # 30 second timeout for server password
         server_password_attempt = client_socket.recv(1024).decode("utf-8", errors="ignore").strip()
         client_socket.settimeout(None) # Reset timeout immediately after receive
 
-        if server_password_attempt != SERVER_PASSWORD:
-            client_socket.send("Incorrect server password.\n".encode("utf-8"))
+        if not hmac.compare_digest(server_password_attempt.encode("utf-8"), SERVER_PASSWORD_BYTES): # Constant-time
+            client_socket.sendall(b"Incorrect server password.\n")
             print(color_text(f"{get_current_time()} [Auth] Failed server password attempt from {addr}", "yellow"))
             return # Exit handle_login
 
         # --- Username Input and Validation ---
-        client_socket.send("Server password OK. Enter username: ".encode("utf-8"))
+        client_socket.sendall(b"Server password OK. Enter username: \n")
         client_socket.settimeout(60) # Allow more time for username/password/registration
         username = client_socket.recv(1024).decode("utf-8", errors="ignore").strip()
         # Timeout will be reset after next receive or explicitly on error/return
@@ -761,15 +926,15 @@ def handle_login(client_socket, addr):
                              all(c.isalnum() or c in ['_', '-'] for c in username))
 
         if not is_valid_username:
-            client_socket.send("Username invalid (1-18 chars, alphanumeric, _, -).\n".encode("utf-8"))
+            client_socket.sendall(b"Username invalid (1-18 chars, alphanumeric, _, -).\n")
             print(color_text(f"{get_current_time()} [Auth] Invalid username attempt from {addr}: '{username}'", "yellow"))
             client_socket.settimeout(None) # Ensure timeout reset on early exit
             return # Exit handle_login
 
-        # --- Check if User is Already Logged In (Unchanged, uses 'clients' dict) ---
+        # --- Check if User is Already Logged In (O(1) via client_sockets_by_name) ---
         with lock:
-            if username in clients.values():
-                client_socket.send("Username already logged in.\n".encode("utf-8"))
+            if username in client_sockets_by_name:
+                client_socket.sendall(b"Username already logged in.\n")
                 print(color_text(f"{get_current_time()} [Auth] Duplicate login attempt from {addr} for user: '{username}'", "yellow"))
                 client_socket.settimeout(None) # Ensure timeout reset on early exit
                 return # Exit handle_login
@@ -788,7 +953,7 @@ def handle_login(client_socket, addr):
             # No commit needed for SELECT
         except sqlite3.Error as e:
             print(color_text(f"{get_current_time()} [Auth DB Error] Error checking user existence for '{username}': {e}", "red"))
-            client_socket.send("Server database error during login.\n".encode("utf-8"))
+            client_socket.sendall(b"Server database error during login.\n")
             client_socket.settimeout(None)
             return # Exit handle_login
         finally:
@@ -800,21 +965,32 @@ def handle_login(client_socket, addr):
         if user_exists_in_db:
             # --- Existing User Login Logic ---
             print(color_text(f"{get_current_time()} [Auth] User '{username}' exists, prompting for password.", "blue"))
-            client_socket.send("Username OK. Enter password: ".encode("utf-8"))
+            client_socket.sendall(b"Username OK. Enter password: \n")
             # Timeout still 60 seconds from username prompt
             password = client_socket.recv(1024).decode("utf-8", errors="ignore").strip()
             client_socket.settimeout(None) # Reset timeout after receiving password
 
-            hashed_password_attempt = hash_password(password)
-
             # Compare attempt with the hash retrieved from the DB earlier
-            if stored_password_hash == hashed_password_attempt:
+            if verify_password(password, stored_password_hash):
                 print(color_text(f"{get_current_time()} [Auth] Password correct for {username}.", "green"))
                 login_successful = True
-                client_socket.send("Login successful.\n".encode("utf-8"))
+                if not stored_password_hash.startswith("pbkdf2_sha256$"):
+                    # Upgrade a legacy unsalted hash now that we know the plain password
+                    try:
+                        db_conn = sqlite3.connect(DATABASE_FILE)
+                        db_conn.execute("UPDATE users SET password_hash = ? WHERE username = ?",
+                                        (hash_password(password), username))
+                        db_conn.commit()
+                    except sqlite3.Error as e:
+                        print(color_text(f"{get_current_time()} [Auth DB Error] Could not upgrade password hash for '{username}': {e}", "yellow"))
+                    finally:
+                        if db_conn:
+                            db_conn.close()
+                            db_conn = None
+                client_socket.sendall(b"Login successful.\n")
                 # Proceed to post-login actions below
             else:
-                client_socket.send("Incorrect password.\n".encode("utf-8"))
+                client_socket.sendall(b"Incorrect password.\n")
                 print(color_text(f"{get_current_time()} [Auth] Failed password for user {username} from {addr}", "yellow"))
                 return # Exit handle_login
 
@@ -822,14 +998,14 @@ def handle_login(client_socket, addr):
             # --- New User / Registration Logic ---
             print(color_text(f"{get_current_time()} [Auth] User '{username}' does not exist. Checking registration status.", "blue"))
             if not ALLOW_USER_AUTHENTICATION:
-                client_socket.send("User registration is not enabled on this server.\n".encode("utf-8"))
+                client_socket.sendall(b"User registration is not enabled on this server.\n")
                 print(color_text(f"{get_current_time()} [Auth] Registration disabled, rejected new user '{username}' from {addr}", "yellow"))
                 client_socket.settimeout(None) # Ensure timeout reset
                 return # Exit handle_login
 
             # Registration is allowed, proceed
             print(color_text(f"{get_current_time()} [Auth] Registration enabled for new user '{username}'.", "yellow"))
-            client_socket.send("Username not found. Enter password in format 'new_password:new_password' to register: ".encode("utf-8"))
+            client_socket.sendall(b"Username not found. Enter password in format 'new_password:new_password' to register: \n")
             # Timeout still 60 seconds from username prompt
             reg_password_input = client_socket.recv(1024).decode("utf-8", errors="ignore").strip()
             client_socket.settimeout(None) # Reset timeout after receiving password
@@ -853,11 +1029,11 @@ def handle_login(client_socket, addr):
                     registration_ok = True
                 except sqlite3.IntegrityError: # Catch if username somehow got created between check and insert (rare)
                     print(color_text(f"{get_current_time()} [Auth DB Error] IntegrityError: Username '{username}' likely created concurrently.", "red"))
-                    client_socket.send("Registration failed (username conflict).\n".encode("utf-8"))
+                    client_socket.sendall(b"Registration failed (username conflict).\n")
                     return # Exit handle_login
                 except sqlite3.Error as e:
                     print(color_text(f"{get_current_time()} [Auth DB Error] Error registering user '{username}': {e}", "red"))
-                    client_socket.send("Server database error during registration.\n".encode("utf-8"))
+                    client_socket.sendall(b"Server database error during registration.\n")
                     return # Exit handle_login
                 finally:
                     if db_conn:
@@ -867,27 +1043,27 @@ def handle_login(client_socket, addr):
                 if registration_ok:
                     print(color_text(f"{get_current_time()} [Auth] User '{username}' registered successfully from {addr}.", "green"))
                     login_successful = True
-                    client_socket.send("Registration successful.\n".encode("utf-8")) # Send registration success first
+                    client_socket.sendall(b"Registration successful.\n") # Send registration success first
 
             else:
                 # Invalid registration format or mismatch
-                client_socket.send("Invalid registration password format or passwords do not match.\n".encode("utf-8"))
+                client_socket.sendall(b"Invalid registration password format or passwords do not match.\n")
                 print(color_text(f"{get_current_time()} [Auth] Invalid registration attempt for '{username}' from {addr}.", "yellow"))
                 return # Exit handle_login
 
         # --- Post-Login / Post-Registration Actions (only if login_successful is True) ---
         if login_successful:
             with lock:
-                clients[client_socket] = username # Add to active clients list
+                add_client(client_socket, username) # Add to active clients list
             print(color_text(f"{get_current_time()} [Connect] {username} joined from {addr}.", "cyan"))
 
-            welcome_msg = format_for_client(f"Welcome to {SERVER_NAME}, {username}!", "[Welcome]") + "\n"
-            client_socket.send(welcome_msg.encode("utf-8"))
+            welcome_msg = format_for_client(f"Welcome to {SERVER_NAME}, {username}!", "[Welcome]")
+            send_to_client(client_socket, welcome_msg.encode("utf-8"))
 
             with lock:
                 is_op = username in ops # Check ops list (still in memory/JSON)
             if is_op:
-                client_socket.send(format_for_client("You are logged in as an Operator.", "[Info]").encode("utf-8") + b"\n")
+                send_to_client(client_socket, format_for_client("You are logged in as an Operator.", "[Info]").encode("utf-8"))
 
             join_msg = format_for_client(f"{username} has joined the chat!", "[Info]")
             broadcast(join_msg, client_socket) # Notify others
@@ -902,7 +1078,7 @@ def handle_login(client_socket, addr):
     # --- Error Handling ---
     except socket.timeout:
         print(color_text(f"{get_current_time()} [Auth] Login/Registration timeout from {addr}", "yellow"))
-        try: client_socket.send("Timeout during login/registration. Connection closed.\n".encode("utf-8"))
+        try: client_socket.sendall(b"Timeout during login/registration. Connection closed.\n")
         except: pass
     except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as e:
         print(color_text(f"{get_current_time()} [Auth] Connection lost during login/registration from {addr}: {e}", "yellow"))
@@ -910,7 +1086,7 @@ def handle_login(client_socket, addr):
         print(color_text(f"{get_current_time()} [Auth Error] Error during login/registration from {addr}: {e}", "red"))
         import traceback
         traceback.print_exc()
-        try: client_socket.send("An error occurred during login/registration. Connection closed.\n".encode("utf-8"))
+        try: client_socket.sendall(b"An error occurred during login/registration. Connection closed.\n")
         except: pass
     finally:
         # Ensure timeout is reset if it was set and we exited early
@@ -934,24 +1110,10 @@ def shutdown_server(exit_code=0):
     global server_socket, clients
     print(color_text(f"{get_current_time()} [Shutdown] Shutting down server...", "red"))
 
-    # Grab client list and clear the global dict under lock
-    with lock:
-        client_sockets_to_close = list(clients.keys())
-        clients.clear() # Prevent new messages during shutdown
-
-    shutdown_message = format_for_client("Server is shutting down. Goodbye!", "[Warning]") + "\n"
-    print(color_text(f"{get_current_time()} [Shutdown] Closing {len(client_sockets_to_close)} client socket(s)...", "yellow"))
-    for client in client_sockets_to_close:
-        try:
-            # Use a short timeout for sending the shutdown message
-            client.settimeout(0.5)
-            client.send(shutdown_message.encode("utf-8"))
-            client.settimeout(None) # Reset timeout
-            client.shutdown(socket.SHUT_RDWR) # Signal shutdown
-        except: pass # Ignore errors sending/shutting down (client might be gone)
-        finally:
-            try: client.close() # Ensure close is attempted
-            except: pass
+    # The goodbye goes through each client's writer, after any broadcast still queued (e.g. the /stop warning)
+    print(color_text(f"{get_current_time()} [Shutdown] Closing client sockets...", "yellow"))
+    closed_count = disconnect_all_clients(format_for_client("Server is shutting down. Goodbye!", "[Warning]"))
+    print(color_text(f"{get_current_time()} [Shutdown] Closed {closed_count} client socket(s).", "yellow"))
 
     # Close the main server socket
     local_server_socket = server_socket # Copy reference
@@ -976,22 +1138,9 @@ def restart_server():
     print(color_text(f"{get_current_time()} [Restart] Restarting server...", "red"))
 
     # Similar shutdown sequence as shutdown_server
-    with lock:
-        client_sockets_to_close = list(clients.keys())
-        clients.clear()
-
-    restart_message = format_for_client("Server is restarting. Please reconnect shortly.", "[Warning]") + "\n"
-    print(color_text(f"{get_current_time()} [Restart] Closing {len(client_sockets_to_close)} client socket(s)...", "yellow"))
-    for client in client_sockets_to_close:
-        try:
-            client.settimeout(0.5)
-            client.send(restart_message.encode("utf-8"))
-            client.settimeout(None)
-            client.shutdown(socket.SHUT_RDWR)
-        except: pass
-        finally:
-            try: client.close()
-            except: pass
+    print(color_text(f"{get_current_time()} [Restart] Closing client sockets...", "yellow"))
+    closed_count = disconnect_all_clients(format_for_client("Server is restarting. Please reconnect shortly.", "[Warning]"))
+    print(color_text(f"{get_current_time()} [Restart] Closed {closed_count} client socket(s).", "yellow"))
 
     local_server_socket = server_socket
     server_socket = None
@@ -1055,25 +1204,12 @@ def console_commands():
                     else:
                         username_to_kick = parts[1]
                         reason = parts[2] if len(parts) > 2 else "Console Kick"
-                        target_socket_kick = None
-                        for sock, user in clients.items():
-                            if user == username_to_kick:
-                                target_socket_kick = sock
-                                break
+                        target_socket_kick = client_sockets_by_name.get(username_to_kick)
 
                         if target_socket_kick:
-                            kick_message = format_for_client(f"You have been kicked by the Console. Reason: {reason}", "[Kick]") + "\n"
-                            try:
-                                target_socket_kick.sendall(kick_message.encode("utf-8"))
-                                time.sleep(0.1) # Give message time to send
-                                target_socket_kick.shutdown(socket.SHUT_RDWR)
-                            except OSError as e:
-                                print(color_text(f"[Kick Error] Couldn't send kick/shutdown socket for {username_to_kick}: {e}", "red"), flush=True)
-                            finally:
-                                # Remove under lock regardless of send error
-                                clients.pop(target_socket_kick, None)
-                                try: target_socket_kick.close()
-                                except: pass
+                            kick_message = format_for_client(f"You have been kicked by the Console. Reason: {reason}", "[Kick]")
+                            # Non-blocking: the writer sends the kick message, then shuts the socket down
+                            remove_client(target_socket_kick, goodbye=kick_message.encode("utf-8"))
                             kick_success = True
                             broadcast_msg_kick = format_for_client(f"{username_to_kick} was kicked by the Console. Reason: {reason}", "[Info]")
                             print(color_text(f"[Kick] Kicked {username_to_kick} from console. Reason: {reason}", "red"), flush=True) # Console confirmation
@@ -1113,10 +1249,7 @@ def console_commands():
                             ops.append(username_to_op)
                             print(color_text(f"{username_to_op} is now an operator.", "green"), flush=True)
                             # Find socket for notification *while holding lock*
-                            for sock, user in clients.items():
-                                if user == username_to_op:
-                                    target_socket_op = sock
-                                    break
+                            target_socket_op = client_sockets_by_name.get(username_to_op)
                             op_needs_save = True # Mark for saving outside lock
                     # Lock released
 
@@ -1125,8 +1258,8 @@ def console_commands():
                         save_ops(ops) # Save the modified list
                         if target_socket_op: # Check if socket was found
                             try:
-                                notify_msg = format_for_client("You have been promoted to Operator by the Console.", "[Info]") + "\n"
-                                target_socket_op.send(notify_msg.encode("utf-8"))
+                                notify_msg = format_for_client("You have been promoted to Operator by the Console.", "[Info]")
+                                send_to_client(target_socket_op, notify_msg.encode("utf-8"))
                             except Exception as e:
                                 print(color_text(f"[Info] Could not notify {username_to_op} of OP status: {e}", "yellow"), flush=True)
 
@@ -1147,10 +1280,7 @@ def console_commands():
                                  op_needs_save = True # Mark for saving outside lock
                                  print(color_text(f"{username_to_deop} is no longer an operator.", "yellow"), flush=True) # Console confirmation
                                  # Find socket for notification *while holding lock*
-                                 for sock, user in clients.items():
-                                     if user == username_to_deop:
-                                         target_socket_deop = sock
-                                         break
+                                 target_socket_deop = client_sockets_by_name.get(username_to_deop)
                              except ValueError:
                                  print(color_text(f"Error removing {username_to_deop} from ops list (not found during remove?).", "red"), flush=True)
                                  op_removed = False # Ensure flag is false on error
@@ -1161,8 +1291,8 @@ def console_commands():
                          save_ops(ops) # Save the modified list
                          if target_socket_deop: # Check if socket was found
                              try:
-                                 notify_msg = format_for_client("Your Operator status has been removed by the Console.", "[Info]") + "\n"
-                                 target_socket_deop.send(notify_msg.encode("utf-8"))
+                                 notify_msg = format_for_client("Your Operator status has been removed by the Console.", "[Info]")
+                                 send_to_client(target_socket_deop, notify_msg.encode("utf-8"))
                              except Exception as e:
                                  print(color_text(f"[Info] Could not notify {username_to_deop} of DEOP status: {e}", "yellow"), flush=True)
 
@@ -1252,6 +1382,23 @@ Server Console Commands:
 
 
 # --- Main Server Function ---
+def configure_client_socket(client_socket):
+    """Tunes a freshly accepted client socket: no Nagle delay, and dead peers are detected by the OS."""
+    options = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1), # Chat lines are small and interactive
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    # Keepalive timing and TCP_USER_TIMEOUT aren't available on every platform
+    for name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                        ("TCP_KEEPCNT", KEEPALIVE_COUNT), ("TCP_USER_TIMEOUT", TCP_USER_TIMEOUT_MS)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    for level, option, value in options:
+        try:
+            client_socket.setsockopt(level, option, value)
+        except OSError:
+            pass # Not fatal: the connection still works with default options
+
 def server():
     global server_socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -1262,6 +1409,13 @@ def server():
         # This might fail on some systems/configurations, often not critical
         print(color_text(f"{get_current_time()} [Warning] Could not set SO_REUSEADDR: {e} (might be normal on some systems).", "yellow"))
 
+    # Set on the listening socket so accepted connections inherit them before the handshake sizes the TCP window
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            server_socket.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+        except OSError as e:
+            print(color_text(f"{get_current_time()} [Warning] Could not set socket buffer size: {e}", "yellow"))
+
     try:
         server_socket.bind((HOST, PORT))
     except OSError as e:
@@ -1269,13 +1423,19 @@ def server():
         print(color_text("Check if the port is already in use or if you have permissions.", "red"))
         sys.exit(1)
 
-    server_socket.listen(5) # Listen for incoming connections (backlog of 5)
+    server_socket.listen(socket.SOMAXCONN) # Largest backlog the OS allows, so connection bursts aren't refused
     print(color_text(f"{get_current_time()} [Start] Server '{SERVER_NAME}' started on {HOST}:{PORT}", "green"))
     print(color_text(f"{get_current_time()} [Start] Base file directory: {os.path.abspath(FILE_DIRECTORY)}", "green"))
     print(color_text(f"{get_current_time()} [Start] User registration enabled: {ALLOW_USER_AUTHENTICATION}", "green")) # Log registration status
     print(color_text(f"{get_current_time()} [Start] Using database '{DATABASE_FILE}' for users. Loaded {len(ops)} operator(s).", "green"))
 
 
+    try:
+        # Applies to threads started from here on: one login/handler thread per client
+        threading.stack_size(THREAD_STACK_SIZE)
+    except (ValueError, RuntimeError) as e:
+        print(color_text(f"{get_current_time()} [Warning] Could not set thread stack size: {e}", "yellow"))
+
     # Start the console command handler thread
     console_thread = threading.Thread(target=console_commands, name="ConsoleThread")
     console_thread.daemon = True # Allows main thread to exit even if console thread is blocking on input
@@ -1286,6 +1446,7 @@ def server():
         try:
             # Accept new connections - this blocks until a connection arrives
             client_socket, addr = server_socket.accept()
+            configure_client_socket(client_socket)
             # Start a new thread to handle the login process for this client
             login_thread = threading.Thread(target=handle_login, args=(client_socket, addr), name=f"Login-{addr}")
             login_thread.daemon = True # Allow main program to exit even if login threads are running
@@ -6,7 +6,6 @@ import customtkinter as ctk
 # Import CTkInputDialog explicitly
 from customtkinter import CTkInputDialog
 from tkinter import messagebox, BOTH, LEFT, RIGHT, TOP, X, Y, END, DISABLED, NORMAL # Import specific tkinter constants
-import datetime
 import threading
 import re
 import sys
@@ -16,6 +15,12 @@ import playsound
 import tkinterdnd2 # NEW - Import the module directly
 import time # Import time module
 import webbrowser # NEW - For opening links
+import bisect
+import collections
+import functools
+import queue
+import selectors
+import traceback
 
 # --- Configuration Files ---
 DOWNLOAD_DIR = os.path.expanduser("~/Downloads")
@@ -24,6 +29,12 @@ if not os.path.exists(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR)
     print(f"[Info] Created download directory: {DOWNLOAD_DIR}")
 
+RECV_CHUNK_SIZE = 65536 # Max bytes per recv() while draining the socket (and per file-download read)
+SOCKET_BUFFER_SIZE = 1 << 20 # Kernel SO_RCVBUF/SO_SNDBUF request (1 MiB) so file transfers aren't window-limited
+RECV_DONTWAIT_FLAG = getattr(socket, "MSG_DONTWAIT", 0) # Per-call non-blocking recv (POSIX); 0 = one recv per wakeup
+SELECT_TIMEOUT = 0.5 # Seconds; lets the receive thread notice a locally closed socket
+MAX_CHAT_LINES = 10_000 # Chat history kept in the message box; oldest lines are dropped first
+
 SOUND_FILE = "sound_option.json"
 SESSION_FILE = "session.json" # For remembering login details
 
@@ -42,6 +53,19 @@ def save_sound_setting(value):
 
 NOTIFICATION_SOUND = load_sound_setting()
 
+# --- Time Formatting ---
+_clock_second = None # Last whole second formatted by get_current_time()
+_clock_text = ""     # Its "HH:MM:SS" text
+
+def get_current_time():
+    """Returns the current time formatted as HH:MM:SS, formatting at most once per second."""
+    global _clock_second, _clock_text
+    second = int(time.time())
+    if second != _clock_second:
+        _clock_text = time.strftime("%X", time.localtime(second))
+        _clock_second = second
+    return _clock_text
+
 # --- Session Load/Save ---
 def load_session():
     """Loads session data (IP, Port, Username, optional Passwords) from session.json."""
@@ -100,11 +124,42 @@ send_button = None
 # Sidebars
 control_sidebar_frame = None
 file_sidebar_frame = None
-file_sidebar_scrollable = None
+file_sidebar_textbox = None
 file_sidebar_user_label = None
+sidebar_list_username = None # Owner of the files currently shown in the sidebar
+sidebar_files = [] # Sorted filenames currently shown in the sidebar (one per line)
+sidebar_file_set = set() # Same names as sidebar_files, for O(1) diffing
 # Control Buttons
 mute_button = None
 
+# --- Window Liveness (tracked in Python to avoid winfo_exists() Tcl round-trips) ---
+_chat_alive = False  # True while chat_window (and its children) exist
+_login_alive = False # True while login_window (and its children) exist
+
+# --- Disconnect Guard (set by the first handle_disconnection, cleared on login) ---
+_disconnected = False
+_disconnect_lock = threading.Lock() # Makes the check-and-set of _disconnected atomic across threads
+
+# --- Message Tags (configured once per message_box) ---
+MESSAGE_TAG_COLORS = {
+    "incoming": "#00BFFF",              # DodgerBlue
+    "outgoing": "#7B68EE",              # MediumSlateBlue
+    "error": "#FF0000",                 # Red
+    "client_command_output": "#2E8B57", # SeaGreen
+    "file_status": "#00FFFF",           # Cyan <<< NEW TAG for file transfers
+}
+
+# --- Pending Display Queue (filled from any thread, flushed on the Tk thread) ---
+_pending_messages = collections.deque() # (message, tag) tuples waiting to be inserted
+_pending_lock = threading.Lock()
+_flush_scheduled = False
+
+
+# --- Command Sending ---
+def send_command(command):
+    """Encodes a chat command/message once and writes it to the server as one newline-terminated line."""
+    client_socket.sendall(f"{command}\n".encode("utf-8"))
+
 
 # --- File Drop Handling (Upload Only) ---
 def handle_file_drop(event):
@@ -133,7 +188,7 @@ def handle_file_drop(event):
             command = f"/upload \"{file_path}\"" # Enclose path in quotes
             display_message(f"Initiating upload request for: {os.path.basename(file_path)}\n", "client_command_output")
             try:
-                client_socket.send(command.encode("utf-8"))
+                send_command(command)
             except (BrokenPipeError, OSError) as e:
                 handle_disconnection(f"Failed to send upload command: {e}")
                 return
@@ -155,6 +210,7 @@ def login():
     global client_socket, username, login_window, login_button
     global ip_entry, port_entry, password_entry, username_entry, user_password_entry
     global remember_session_checkbox, save_passwords_checkbox # Include new checkbox
+    global _disconnected
 
     server_ip = ip_entry.get()
     server_port_str = port_entry.get()
@@ -187,6 +243,12 @@ def login():
             client_socket = None
 
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Size buffers before connect() so they shape the TCP window; send chat lines without Nagle delay
+        try:
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError: pass # Not fatal: OS defaults still work
         client_socket.settimeout(10) # Timeout for connection and initial steps
         client_socket.connect((server_ip, server_port))
         if login_button: login_button.configure(text="Authenticating...")
@@ -196,7 +258,7 @@ def login():
         print(f"[Debug Login] R1: {response1}") # e.g., "Enter server password: "
         if "Enter server password:" not in response1:
              raise ValueError(f"Unexpected initial response:\n'{response1}'")
-        client_socket.send(server_password_input.encode("utf-8"))
+        client_socket.sendall(server_password_input.encode("utf-8"))
 
         # --- Step 2: Send Username ---
         response2 = client_socket.recv(1024).decode("utf-8", errors="ignore").strip()
@@ -206,7 +268,7 @@ def login():
                  raise ValueError("Incorrect server password.")
              else:
                  raise ValueError(f"Unexpected response after server pass:\n'{response2}'")
-        client_socket.send(username_input.encode("utf-8"))
+        client_socket.sendall(username_input.encode("utf-8"))
         if login_button: login_button.configure(text="Checking User...")
 
         # --- Step 3: Handle Response after Username (Login, Register, or Error) ---
@@ -220,7 +282,7 @@ def login():
             # Check if user password was provided in the UI
             if not user_password_input:
                  raise ValueError("Existing user requires User Password field to be filled.")
-            client_socket.send(user_password_input.encode("utf-8"))
+            client_socket.sendall(user_password_input.encode("utf-8"))
             response4_login = client_socket.recv(1024).decode("utf-8", errors="ignore").strip()
             print(f"[Debug Login] R4 (Login): {response4_login}")
             if response4_login == "Login successful.":
@@ -249,7 +311,7 @@ def login():
 
             # Send registration password to server
             if login_button: login_button.configure(text="Registering...")
-            client_socket.send(reg_password.encode("utf-8"))
+            client_socket.sendall(reg_password.encode("utf-8"))
 
             # Get final response after registration attempt
             response4_reg = client_socket.recv(1024).decode("utf-8", errors="ignore").strip()
@@ -281,6 +343,7 @@ def login():
         # --- If Login or Registration was Successful ---
         if login_successful:
             client_socket.settimeout(None) # Disable timeout for regular chat
+            with _disconnect_lock: _disconnected = False # New session: allow the next disconnect to be handled
             username = username_input # Set global username
 
             # --- Handle Session Saving ---
@@ -333,14 +396,13 @@ def login():
          login_successful = False
     except Exception as e:
         messagebox.showerror("Connection Error", f"An unexpected error occurred: {e}")
-        import traceback
         traceback.print_exc() # Log unexpected errors
         if client_socket: client_socket.close()
         client_socket = None
         login_successful = False
     finally:
         # Re-enable login button only if login/registration failed AND the button exists
-        if not login_successful and login_button and login_button.winfo_exists():
+        if not login_successful and _login_alive and login_button:
              try:
                  login_button.configure(state="normal", text="Login")
              except Exception as ui_error:
@@ -350,14 +412,17 @@ def login():
 # --- Open Chat Window (Added "file_status" tag) ---
 def open_chat_window():
     global chat_window, message_box, message_entry, send_button, mute_button
-    global control_sidebar_frame, file_sidebar_frame, file_sidebar_scrollable, file_sidebar_user_label
+    global control_sidebar_frame, file_sidebar_frame, file_sidebar_textbox, file_sidebar_user_label
+    global sidebar_list_username, sidebar_files, sidebar_file_set
     global root
 
-    if chat_window and chat_window.winfo_exists():
+    global _chat_alive
+
+    if _chat_alive and chat_window:
         chat_window.deiconify()
-        if message_entry and message_entry.winfo_exists(): message_entry.configure(state="normal")
-        if send_button and send_button.winfo_exists(): send_button.configure(state="normal")
-        if file_sidebar_scrollable and file_sidebar_scrollable.winfo_exists(): update_file_sidebar("No user selected", []) # Update sidebar on reopen
+        if message_entry: message_entry.configure(state="normal")
+        if send_button: send_button.configure(state="normal")
+        if file_sidebar_textbox: update_file_sidebar("No user selected", []) # Update sidebar on reopen
         update_mute_button_text()
         chat_window.lift()
         return
@@ -366,6 +431,8 @@ def open_chat_window():
     chat_window.title(f"JAPIRC GUI Client - {username}")
     chat_window.geometry("850x550")
     chat_window.protocol("WM_DELETE_WINDOW", on_chat_window_close)
+    chat_window.bind("<Destroy>", _on_chat_window_destroyed)
+    _chat_alive = True
 
     # Left Sidebar
     control_sidebar_frame = ctk.CTkFrame(chat_window, width=150)
@@ -393,11 +460,8 @@ def open_chat_window():
     message_box = ctk.CTkTextbox(main_frame, state="disabled", wrap="word", font=("Arial", 12))
     message_box.pack(padx=0, pady=(0, 5), fill=BOTH, expand=True)
     # Configure message tags
-    message_box.tag_config("incoming", foreground="#00BFFF") # DodgerBlue
-    message_box.tag_config("outgoing", foreground="#7B68EE") # MediumSlateBlue
-    message_box.tag_config("error", foreground="#FF0000")   # Red
-    message_box.tag_config("client_command_output", foreground="#2E8B57") # SeaGreen
-    message_box.tag_config("file_status", foreground="#00FFFF") # Cyan <<< NEW TAG for file transfers
+    for tag_name, color in MESSAGE_TAG_COLORS.items():
+        message_box.tag_config(tag_name, foreground=color)
 
     entry_frame = ctk.CTkFrame(main_frame)
     entry_frame.pack(padx=0, pady=(5, 0), fill=X)
@@ -419,8 +483,16 @@ def open_chat_window():
     # Populate Right Sidebar (File List Display)
     file_sidebar_user_label = ctk.CTkLabel(file_sidebar_frame, text="Files:", anchor="w", font=("default_theme", 14, "bold"))
     file_sidebar_user_label.pack(side=TOP, fill=X, padx=5, pady=(5, 2))
-    file_sidebar_scrollable = ctk.CTkScrollableFrame(file_sidebar_frame, label_text="") # Removed label_text
-    file_sidebar_scrollable.pack(side=TOP, fill=BOTH, expand=True, padx=5, pady=(2, 5))
+    # Single textbox holding one clickable line per file (no per-file widgets)
+    file_sidebar_textbox = ctk.CTkTextbox(file_sidebar_frame, state="disabled", wrap="none", width=170)
+    file_sidebar_textbox.pack(side=TOP, fill=BOTH, expand=True, padx=5, pady=(2, 5))
+    file_sidebar_textbox.tag_config("no_files", foreground="gray")
+    # Show a hand cursor while hovering over any filename line
+    file_sidebar_textbox.tag_bind("file", "<Enter>", lambda event: file_sidebar_textbox.configure(cursor="hand2"))
+    file_sidebar_textbox.tag_bind("file", "<Leave>", lambda event: file_sidebar_textbox.configure(cursor=""))
+    # One shared click handler for every filename line
+    file_sidebar_textbox.tag_bind("file", "<Button-1>", on_sidebar_file_click)
+    sidebar_list_username, sidebar_files, sidebar_file_set = None, [], set() # Fresh textbox, nothing shown yet
     update_file_sidebar("No user selected", []) # Initialize sidebar
 
     # Finalize
@@ -429,6 +501,19 @@ def open_chat_window():
     message_entry.focus_set()
 
 
+def _on_chat_window_destroyed(event):
+    """Marks the chat window as gone once Tk destroys it (ignores child widget events)."""
+    global _chat_alive
+    if event.widget is chat_window:
+        _chat_alive = False
+
+def _on_login_window_destroyed(event):
+    """Marks the login window as gone once Tk destroys it (ignores child widget events)."""
+    global _login_alive
+    if event.widget is login_window:
+        _login_alive = False
+
+
 # --- Action Functions ---
 def logout_action():
     print("[Info] Logout button clicked.")
@@ -436,7 +521,7 @@ def logout_action():
 
 def update_mute_button_text():
     global mute_button, NOTIFICATION_SOUND
-    if mute_button and mute_button.winfo_exists():
+    if _chat_alive and mute_button:
         mute_button_text = "Mute Notifications" if NOTIFICATION_SOUND else "Unmute Notifications"
         mute_button.configure(text=mute_button_text)
 
@@ -454,6 +539,7 @@ def open_github_link():
         display_message(f"Could not open link: {url}\nError: {e}\n", "error")
 
 def close_app_action():
+    global _chat_alive, _login_alive
     print("[Info] Close App button clicked.")
     if client_socket:
         print("[Info] Disconnecting before closing...")
@@ -465,8 +551,12 @@ def close_app_action():
     else:
         print("[Info] Not connected, destroying windows.")
         # Explicitly destroy windows if they exist
-        if chat_window and chat_window.winfo_exists(): chat_window.destroy()
-        if login_window and login_window.winfo_exists(): login_window.destroy()
+        if _chat_alive and chat_window:
+            _chat_alive = False
+            chat_window.destroy()
+        if _login_alive and login_window:
+            _login_alive = False
+            login_window.destroy()
 
     if root:
         print("[Info] Quitting root Tkinter application.")
@@ -475,12 +565,11 @@ def close_app_action():
 
 # --- Chat Window Close Handling ---
 def on_chat_window_close():
-    global client_socket, chat_window, login_window
+    global client_socket, chat_window, login_window, _chat_alive
     if client_socket:
         try:
             print("[Info] Sending /exit command...")
-            client_socket.send("/exit".encode("utf-8"))
-            time.sleep(0.1) # Give a moment for the message to send
+            client_socket.sendall(b"/exit\n") # Returns once queued; close() below still delivers it
         except (OSError, BrokenPipeError) as e:
             print(f"[Info] Error sending /exit (socket likely closed): {e}")
         finally:
@@ -494,17 +583,18 @@ def on_chat_window_close():
 
     if chat_window:
         print("[Info] Destroying chat window...")
+        _chat_alive = False
         chat_window.destroy()
         chat_window = None # Crucial: set to None after destroying
 
     # Show login window after closing chat window
-    if login_window and login_window.winfo_exists():
+    if _login_alive and login_window:
          try:
              print("[Info] Showing login window...")
              login_window.deiconify()
              login_window.lift()
              # Reset login button state if needed (though handle_disconnection might also do this)
-             if login_button and login_button.winfo_exists():
+             if login_button:
                   login_button.configure(state="normal", text="Login")
          except Exception as e:
              print(f"[Error] Could not show login window: {e}. Quitting.")
@@ -527,8 +617,6 @@ def send_message():
         handle_disconnection("Attempted to send while disconnected.")
         return
 
-    current_time_str = datetime.datetime.now().strftime("%X")
-
     try:
         # --- Client-Side Commands ---
         if message.startswith("/exit"):
@@ -552,7 +640,7 @@ def send_message():
                     # Send command with path in quotes for server
                     command_to_send = f'/upload "{local_path}"'
                     display_message(f"Initiating upload request for: {os.path.basename(local_path)}\n", "client_command_output")
-                    client_socket.send(command_to_send.encode("utf-8"))
+                    send_command(command_to_send)
                 elif not os.path.exists(local_path):
                     display_message(f"Error: Local file not found for upload: {local_path}\n", "error")
                 else: # Path exists but isn't a file
@@ -565,7 +653,7 @@ def send_message():
             parts = message.split(" ", 1)
             if len(parts) == 2 and parts[1].strip():
                 target_user = parts[1].strip()
-                client_socket.send(message.encode("utf-8")) # Send raw command
+                send_command(message) # Send raw command
                 display_message(f"Requesting file list for user: {target_user}\n", "client_command_output")
             else:
                 display_message("Usage: /files <username>\n", "error")
@@ -576,7 +664,7 @@ def send_message():
         elif message.startswith("/delete"):
             parts = message.split(" ", 1) # Check if at least one arg exists
             if len(parts) >= 2 and parts[1].strip():
-                client_socket.send(message.encode("utf-8")) # Send raw command to server
+                send_command(message) # Send raw command to server
                 display_message(f"Sending delete request: {message}\n", "client_command_output")
             else:
                 display_message("Usage: /delete <filename> OR /delete <user> <filename> (Operator only)\n", "error")
@@ -584,10 +672,10 @@ def send_message():
 
         else:
             # Send regular message or other server command
-            client_socket.send(message.encode("utf-8"))
+            send_command(message)
             # Display outgoing non-command messages
             if not message.startswith("/"):
-                display_message(f"{current_time_str} [{username}]: {message}\n", "outgoing")
+                display_message(f"{get_current_time()} [{username}]: {message}\n", "outgoing")
             message_entry.delete(0, END) # Clear entry after sending any message/command
 
     except (BrokenPipeError, OSError, ConnectionResetError) as e:
@@ -595,122 +683,125 @@ def send_message():
     except Exception as e:
          display_message(f"An unexpected error occurred sending the message: {e}\n", "error")
          # Optionally clear the entry even on unexpected errors
-         if message_entry and message_entry.winfo_exists(): message_entry.delete(0, END)
+         if _chat_alive and message_entry: message_entry.delete(0, END)
 
 
 # --- Receive Messages (Improved file transfer messages) ---
+def drain_socket(sock, selector, buffer):
+    """
+    Waits until the socket is readable, then appends everything currently available to buffer.
+    Returns the number of bytes read, 0 if the server closed the connection, or None on timeout.
+    """
+    if not selector.select(timeout=SELECT_TIMEOUT):
+        return None
+    data = sock.recv(RECV_CHUNK_SIZE) # Socket is readable, so this returns without blocking
+    if not data: return 0
+    buffer += data
+    received = len(data)
+    # A full chunk means more may be waiting; read it with MSG_DONTWAIT so the socket itself
+    # stays blocking for the sendall() calls made from the Tk thread
+    while RECV_DONTWAIT_FLAG and len(data) == RECV_CHUNK_SIZE:
+        try:
+            data = sock.recv(RECV_CHUNK_SIZE, RECV_DONTWAIT_FLAG)
+        except BlockingIOError:
+            break # Kernel buffer drained
+        if not data: break # Deliver what we have, the close is reported on the next call
+        buffer += data
+        received += len(data)
+    return received
+
+def receive_file(sock, selector, header_line, pending):
+    """
+    Saves the payload announced by a 'FILE_TRANSFER:<name>:<size>' header line.
+    File bytes already buffered in 'pending' (read together with the header) are used first;
+    the socket is never read past the end of the file, so following lines stay in the stream.
+    """
+    try:
+        _, filename, file_size_str = header_line.split(":", 2)
+        file_size = int(file_size_str)
+    except ValueError as e:
+        display_message(f"Error: Received malformed file transfer header: {header_line}\n", "error")
+        print(f"[Error] Malformed header details: {e}")
+        return
+
+    # Use the new "file_status" tag and nicer message
+    display_message(f"⬇️ Receiving file: {filename} ({file_size} bytes)...\n", "file_status")
+
+    save_path = os.path.join(DOWNLOAD_DIR, os.path.basename(filename)) # Sanitize filename
+
+    try:
+        with open(save_path, "wb") as file:
+            # Start with any file data that arrived in the same read as the header
+            bytes_received = min(len(pending), file_size)
+            if bytes_received:
+                file.write(pending[:bytes_received])
+                del pending[:bytes_received]
+
+            # Preallocated chunk buffer: socket -> buffer -> file without a new bytes object per chunk
+            chunk_view = memoryview(bytearray(RECV_CHUNK_SIZE))
+            while bytes_received < file_size:
+                # Adjust chunk size based on remaining bytes needed
+                bytes_to_recv = min(RECV_CHUNK_SIZE, file_size - bytes_received)
+                if not selector.select(timeout=SELECT_TIMEOUT):
+                    if client_socket is not sock: break # Disconnected locally
+                    continue
+                n = sock.recv_into(chunk_view[:bytes_to_recv]) # Readable: returns without blocking
+                if not n:
+                    display_message(f"Warning: Connection closed unexpectedly during download of {filename}.\n", "error")
+                    break
+                file.write(chunk_view[:n])
+                bytes_received += n
+
+        if bytes_received == file_size:
+            # Use the new "file_status" tag and nicer completion message
+            display_message(f"✅ File '{os.path.basename(filename)}' saved to Downloads folder.\n", "file_status")
+            play_notification_sound() # Play sound on successful download
+        else:
+            display_message(f"❌ Download incomplete for {filename}. Received {bytes_received}/{file_size} bytes.\n", "error")
+
+    except IOError as e:
+        display_message(f"Error saving file {filename}: {e}\n", "error")
+    except Exception as e:
+        display_message(f"An unexpected error occurred during file download: {e}\n", "error")
+
 def receive_messages():
     global client_socket, username
-    while client_socket:
+    sock = client_socket
+    if not sock: return
+    # Selector wait + drain: one wakeup reads every message that has arrived. The socket stays
+    # in blocking mode (it's shared with the sending side), so only readiness is polled here
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    # Received bytes not yet processed. The server ends every message with a newline, so only
+    # complete lines are handled and a partial line (or split UTF-8 character) waits for the next read
+    recv_buffer = bytearray()
+    # Own-message marker built once per session instead of per message
+    own_message_marker = f"[{username}]:"
+    while client_socket is sock: # Stop once the socket is closed or replaced by a new login
         try:
-            message_bytes = client_socket.recv(4096)
-            if not message_bytes:
+            received = drain_socket(sock, selector, recv_buffer)
+            if received is None: continue # Nothing arrived within SELECT_TIMEOUT
+            if not received:
                 handle_disconnection("Connection closed by server.")
                 break
 
-            # Attempt to decode the entire chunk first
-            try:
-                message = message_bytes.decode("utf-8", errors="ignore")
-            except UnicodeDecodeError:
-                print("[Warning] Decoding error, likely receiving binary data. Checking for header.")
-                # If decode fails, check if it *starts* like a file transfer header
-                if message_bytes.startswith(b"FILE_TRANSFER:"):
-                    # Manually find the end of the header line
-                    try:
-                        # Assume header ends at the first newline. Need robust parsing if headers change.
-                        header_end_index = message_bytes.find(b'\n')
-                        if header_end_index == -1: # Header doesn't end in this chunk? Unlikely but possible
-                            print("[Error] Incomplete file transfer header received in chunk.")
-                            # If the chunk IS the header and no newline, treat it as text for now
-                            # This might fail later, but avoids crashing here. A better solution
-                            # would buffer incomplete headers.
-                            header_line = message_bytes.decode("utf-8", errors="ignore")
-                            remaining_data = b""
-                        else:
-                            header_line = message_bytes[:header_end_index].decode("utf-8", errors="ignore")
-                            remaining_data = message_bytes[header_end_index+1:] # The rest is file data
-
-                        message = header_line # Process the header
-                        print(f"[Debug] Parsed header: {header_line}")
-                        is_file_transfer_chunk = True
-                    except (ValueError, UnicodeDecodeError) as e:
-                         print(f"[Error] Couldn't parse potential file transfer header: {e}")
-                         continue # Skip this chunk if header parsing fails
-                else:
-                    print("[Warning] Received undecodable non-file-transfer data. Skipping.")
-                    continue # Skip if it doesn't look like our file transfer
-            else:
-                # If decode succeeded, check for file transfer header normally
-                is_file_transfer_chunk = message.startswith("FILE_TRANSFER:")
-                remaining_data = None # No remaining binary data if initial decode worked
-
-            if not message: continue
-
-            # --- File Transfer Handling ---
-            if is_file_transfer_chunk:
-                try:
-                    _, filename, file_size_str = message.strip().split(":")
-                    file_size = int(file_size_str)
-                except (ValueError, IndexError) as e:
-                    display_message(f"Error: Received malformed file transfer header: {message.strip()}\n", "error")
-                    print(f"[Error] Malformed header details: {e}")
-                    continue # Skip this faulty transfer attempt
-
-                # Use the new "file_status" tag and nicer message
-                display_message(f"⬇️ Receiving file: {filename} ({file_size} bytes)...\n", "file_status")
-
-                save_path = os.path.join(DOWNLOAD_DIR, os.path.basename(filename)) # Sanitize filename
-
-                try:
-                    with open(save_path, "wb") as file:
-                        bytes_received = 0
-                        # If we already have some data from the header chunk
-                        if remaining_data:
-                            file.write(remaining_data)
-                            bytes_received += len(remaining_data)
-                            print(f"[Debug File] Wrote initial {len(remaining_data)} bytes.")
-
-                        while bytes_received < file_size:
-                            # Adjust chunk size based on remaining bytes needed
-                            bytes_to_recv = min(4096, file_size - bytes_received)
-                            if bytes_to_recv <= 0: break # Should not happen, but safety check
-
-                            chunk = client_socket.recv(bytes_to_recv)
-                            if not chunk:
-                                display_message(f"Warning: Connection closed unexpectedly during download of {filename}.\n", "error")
-                                break # Exit inner loop
-                            file.write(chunk)
-                            bytes_received += len(chunk)
-                            # Optional: Add progress update here if needed (complex)
-                            # print(f"[Debug File] Received chunk: {len(chunk)} bytes. Total: {bytes_received}/{file_size}")
-
-                    if bytes_received == file_size:
-                        # Use the new "file_status" tag and nicer completion message
-                        display_message(f"✅ File '{os.path.basename(filename)}' saved to Downloads folder.\n", "file_status")
-                        play_notification_sound() # Play sound on successful download
-                    else:
-                        display_message(f"❌ Download incomplete for {filename}. Received {bytes_received}/{file_size} bytes.\n", "error")
-                        # Optionally delete the incomplete file
-                        # if os.path.exists(save_path): os.remove(save_path)
-
-                except IOError as e:
-                    display_message(f"Error saving file {filename}: {e}\n", "error")
-                except Exception as e:
-                    display_message(f"An unexpected error occurred during file download: {e}\n", "error")
-
-                continue # Skip normal message handling for this packet
-
-            # --- Regular Message Handling ---
-            # Handle potentially multiple messages in one recv
-            messages = [m for m in message.split('\n') if m] # Split and remove empty strings
-
-            for msg_line in messages:
-                msg_line = msg_line.strip()
+            sound_enabled = NOTIFICATION_SOUND # Snapshot once per received batch (picks up /toggle_sound next batch)
+
+            # --- Process every complete line in the buffer ---
+            while True:
+                newline_index = recv_buffer.find(b"\n")
+                if newline_index == -1: break # Partial line: wait for more data
+                msg_line = recv_buffer[:newline_index].decode("utf-8", errors="replace").strip()
+                del recv_buffer[:newline_index + 1]
                 if not msg_line: continue
 
                 print(f"[Debug Recv] {msg_line}") # Log raw message line
 
-                if msg_line.startswith("FILE_LIST:"):
+                if msg_line.startswith("FILE_TRANSFER:"):
+                    # The payload follows the header; lines after it stay in recv_buffer
+                    receive_file(sock, selector, msg_line, recv_buffer)
+
+                elif msg_line.startswith("FILE_LIST:"):
                     try:
                         parts = msg_line.strip().split(":", 2)
                         if len(parts) == 3:
@@ -719,7 +810,7 @@ def receive_messages():
                             # Split by semicolon and filter out potential empty strings
                             filenames = [fn for fn in filenames_str.split(';') if fn]
                             # Schedule UI update on main thread
-                            if chat_window and chat_window.winfo_exists():
+                            if _chat_alive and chat_window:
                                 chat_window.after(0, update_file_sidebar, list_user, filenames)
                         else:
                              display_message(f"Received malformed FILE_LIST from server: {msg_line}\n", "error")
@@ -733,35 +824,39 @@ def receive_messages():
 
                     # Play sound logic (basic check)
                     # Avoid sound for own messages or simple status messages
-                    is_own_message_approx = f"[{username}]:" in cleaned_message
+                    is_own_message_approx = own_message_marker in cleaned_message
                     # Heuristic for server status messages (might need refinement)
-                    try:
-                        is_server_status = cleaned_message.startswith(f"{datetime.datetime.now().strftime('%X')} [") and cleaned_message.strip().endswith("]")
-                    except Exception: # Catch potential errors in strftime format etc.
-                        is_server_status = False
+                    # get_current_time() only re-formats when the wall-clock second changes
+                    is_server_status = cleaned_message.startswith(get_current_time() + " [") and cleaned_message.endswith("]")
 
-                    if NOTIFICATION_SOUND and not is_own_message_approx and not is_server_status:
+                    if sound_enabled and not is_own_message_approx and not is_server_status:
                         play_notification_sound()
 
         except (ConnectionResetError, BrokenPipeError, OSError) as e:
             print(f"[Info] Connection error in receive loop: {e}")
             # Check if socket is already None (means disconnect handled elsewhere)
-            if client_socket:
+            if client_socket is sock:
                 handle_disconnection(f"Connection lost ({type(e).__name__}).")
             break # Exit loop
         except Exception as e:
             print(f"[Critical Error] Error receiving message: {e}")
             # Ensure stack trace is printed for unexpected errors
-            import traceback
             traceback.print_exc()
-            if client_socket: # Check if socket exists before handling disconnect
+            if client_socket is sock: # Check if socket exists before handling disconnect
                 handle_disconnection(f"An unexpected error occurred ({type(e).__name__}).")
             break # Exit loop
 
+    selector.close()
     print("[Info] Receive thread terminating.")
 
 
 # --- NEW: Function to request file download ---
+@functools.lru_cache(maxsize=256)
+def encode_download_command(uploader, filename):
+    """Builds the encoded /download command, cached for repeated requests of the same file."""
+    # Add quotes around filename in case it contains spaces
+    return f'/download {uploader} "{filename}"\n'.encode("utf-8")
+
 def request_file_download(filename, uploader):
     """Sends a /download command to the server for the specified file."""
     global client_socket
@@ -769,12 +864,10 @@ def request_file_download(filename, uploader):
         display_message("Cannot download: Not connected to server.\n", "error")
         return
 
-    # Add quotes around filename in case it contains spaces
-    command = f'/download {uploader} "{filename}"'
     display_message(f"Requesting download: {filename} from {uploader}\n", "client_command_output")
 
     try:
-        client_socket.send(command.encode("utf-8"))
+        client_socket.sendall(encode_download_command(uploader, filename))
     except (BrokenPipeError, OSError) as e:
         handle_disconnection(f"Error sending download request: {e}")
     except Exception as e:
@@ -782,93 +875,133 @@ def request_file_download(filename, uploader):
 
 
 # --- Update Sidebar (Added click binding) ---
+def on_sidebar_file_click(event):
+    """Requests a download of the filename on the clicked sidebar line."""
+    line_index = event.widget.index(f"@{event.x},{event.y}")
+    filename = event.widget.get(f"{line_index} linestart", f"{line_index} lineend")
+    if filename and sidebar_list_username:
+        request_file_download(filename, sidebar_list_username)
+
 def update_file_sidebar(list_username, filenames):
     """Updates the file list sidebar. Files are clickable to initiate download."""
-    if not file_sidebar_scrollable or not file_sidebar_scrollable.winfo_exists():
+    global sidebar_list_username, sidebar_files, sidebar_file_set
+    if not _chat_alive or not file_sidebar_textbox:
         print("[Debug] Sidebar not ready for update.")
         return
 
-    if file_sidebar_user_label and file_sidebar_user_label.winfo_exists():
-        file_sidebar_user_label.configure(text=f"Files from {list_username}:")
-
-    # Clear existing file labels
-    for widget in file_sidebar_scrollable.winfo_children():
-        widget.destroy()
+    new_file_set = {fn for fn in filenames if fn} # Skip empty names if server sends them
+    same_user = list_username == sidebar_list_username
+    if same_user and new_file_set == sidebar_file_set:
+        return # Nothing changed, leave the sidebar untouched
 
-    if not filenames:
-        no_files_label = ctk.CTkLabel(file_sidebar_scrollable, text="No files found.", text_color="gray")
-        no_files_label.pack(pady=5, anchor="w") # Use anchor='w' for left alignment
-        return
-
-    # Add new file labels (as clickable text)
-    for filename in sorted(filenames): # Sort for consistency
-        if not filename: continue # Skip empty names if server sends them
-        file_label = ctk.CTkLabel(
-            file_sidebar_scrollable,
-            text=filename,
-            cursor="hand2", # <<< ADDED cursor to indicate clickable
-            anchor="w" # anchor='w' for left alignment
-        )
-        file_label.pack(fill=X, padx=5, pady=1) # fill=X makes text fill width
-        # BINDING ADDED - Clicking the label calls request_file_download
-        file_label.bind("<Button-1>", lambda event, fn=filename, uploader=list_username: request_file_download(fn, uploader))
+    if file_sidebar_user_label and not same_user:
+        file_sidebar_user_label.configure(text=f"Files from {list_username}:")
+    sidebar_list_username = list_username
+
+    file_sidebar_textbox.configure(state="normal")
+    if same_user and sidebar_file_set and new_file_set:
+        # Same listing as before: only delete/insert the lines that changed
+        for filename in sidebar_file_set - new_file_set:
+            index = bisect.bisect_left(sidebar_files, filename)
+            file_sidebar_textbox.delete(f"{index + 1}.0", f"{index + 2}.0")
+            del sidebar_files[index]
+        for filename in new_file_set - sidebar_file_set:
+            index = bisect.bisect_left(sidebar_files, filename)
+            file_sidebar_textbox.insert(f"{index + 1}.0", filename + "\n", "file")
+            sidebar_files.insert(index, filename)
+    else:
+        # Rewrite the whole text buffer instead of destroying/creating widgets
+        file_sidebar_textbox.delete("1.0", END)
+        sidebar_files = sorted(new_file_set) # Sort for consistency
+        if not sidebar_files:
+            file_sidebar_textbox.insert(END, "No files found.", "no_files")
+        # Add one clickable line per file
+        # Clicks are dispatched by the shared "file" tag binding (on_sidebar_file_click)
+        for filename in sidebar_files:
+            file_sidebar_textbox.insert(END, filename + "\n", "file")
+    sidebar_file_set = new_file_set
+    file_sidebar_textbox.configure(state="disabled")
 
 
 # --- Play Sound ---
-def play_notification_sound():
-    """Plays the notification sound in a separate thread if enabled."""
-    def play_sound():
-        sound_file = "notification.wav" # Ensure this file exists in the same directory
+SOUND_PATH = "notification.wav" # Ensure this file exists in the same directory
+_sound_queue = queue.Queue(maxsize=1) # One pending beep at most: a burst of messages coalesces into a single notification
+_sound_file_found = None # Cached os.path.exists(SOUND_PATH) result, None = not checked yet
+
+def reset_sound_cache():
+    """Forgets the cached sound file lookup (e.g. after the user drops the file in)."""
+    global _sound_file_found
+    _sound_file_found = None
+
+def _sound_worker():
+    """Long-lived worker that plays one notification per queued request."""
+    global _sound_file_found
+    while True:
+        _sound_queue.get()
+        if _sound_file_found is None:
+            _sound_file_found = os.path.exists(SOUND_PATH)
+            if not _sound_file_found and NOTIFICATION_SOUND:
+                # Only warned once per cache reset, sound is supposed to be enabled
+                print(f"[Sound] Notification sound file not found: {SOUND_PATH}")
+        if not _sound_file_found:
+            continue
         try:
-            if os.path.exists(sound_file):
-                playsound.playsound(sound_file, block=False) # block=False prevents freezing
-            else:
-                # Only print warning if sound is supposed to be enabled
-                if NOTIFICATION_SOUND:
-                    print(f"[Sound] Notification sound file not found: {sound_file}")
+            playsound.playsound(SOUND_PATH) # Blocks this worker only, so plays never overlap on the audio device
         except Exception as e:
             # Catch playsound specific errors or other issues
             # Playsound might have platform-specific issues or dependencies.
             print(f"[Sound Error] Error playing sound: {e}")
 
+threading.Thread(target=_sound_worker, name="SoundThread", daemon=True).start()
+
+def play_notification_sound():
+    """Queues a notification sound for the sound worker thread if enabled."""
     if NOTIFICATION_SOUND:
-        # Run in a separate thread to avoid blocking UI or network operations
-        threading.Thread(target=play_sound, name="SoundThread", daemon=True).start()
+        try:
+            _sound_queue.put_nowait(1)
+        except queue.Full:
+            pass # Enough notifications already pending, drop this one
 
 # --- Handle Disconnection ---
 def handle_disconnection(reason="Connection lost."):
-    global client_socket, chat_window, message_entry, send_button, file_sidebar_scrollable, login_window, login_button
+    global client_socket, chat_window, message_entry, send_button, file_sidebar_textbox, login_window, login_button, _disconnected
+
+    # Only the first disconnect per session closes the socket and schedules the UI update
+    with _disconnect_lock:
+        already_disconnected = _disconnected
+        _disconnected = True
+    if already_disconnected:
+        display_message(f"{reason}\n", "error") # Still tell the user why this action failed
+        return
 
     print(f"[Info] Handling disconnection: {reason}")
 
-    # Prevent multiple disconnect calls race conditions
-    socket_to_close = client_socket
-    if socket_to_close:
-        client_socket = None # Set global to None immediately
+    if client_socket:
         try:
             print("[Info] Closing socket due to disconnection.")
-            socket_to_close.close()
+            client_socket.close()
         except OSError as e:
             print(f"[Info] Non-critical error closing socket on disconnect: {e}")
+        client_socket = None
 
     # Schedule UI updates on the main thread
     def update_ui_on_disconnect():
         display_message(f"\n--- DISCONNECTED ---\n{reason}\n", "error")
         # Update file sidebar to show disconnected state
-        if file_sidebar_scrollable and file_sidebar_scrollable.winfo_exists():
+        if _chat_alive and file_sidebar_textbox:
             update_file_sidebar("Disconnected", [])
         # Disable chat input if chat window still exists
-        if chat_window and chat_window.winfo_exists():
+        if _chat_alive and chat_window:
             display_message("Please use the Login window to reconnect or close the application.\n", "client_command_output")
-            if message_entry and message_entry.winfo_exists(): message_entry.configure(state="disabled")
-            if send_button and send_button.winfo_exists(): send_button.configure(state="disabled")
+            if message_entry: message_entry.configure(state="disabled")
+            if send_button: send_button.configure(state="disabled")
         # Show and enable login window
-        if login_window and login_window.winfo_exists():
+        if _login_alive and login_window:
             try:
                 login_window.deiconify()
                 login_window.lift()
                 # Ensure login button is enabled
-                if login_button and login_button.winfo_exists():
+                if login_button:
                      login_button.configure(state="normal", text="Login")
             except Exception as e: print(f"Error showing/enabling login window on disconnect: {e}")
         else: print("[Info] Login window not available during disconnect handling.")
@@ -880,66 +1013,97 @@ def handle_disconnection(reason="Connection lost."):
         print("[Error] Root window doesn't exist, cannot schedule UI updates for disconnection.")
 
 # --- Display Message ---
-def display_message(message, tag):
-    """Safely displays a message in the message_box from any thread."""
-    def _insert():
-        global message_box
-        if message_box and message_box.winfo_exists():
-            try:
-                message_box.configure(state="normal") # Enable writing
-                message_box.insert(END, message, tag) # Insert text with tag
-                message_box.configure(state="disabled") # Disable writing
-                message_box.see(END) # Auto-scroll to the bottom
-            except Exception as e:
-                # Log error if insertion fails
-                print(f"Error displaying message: {e}\nMessage: {message}")
-        else:
-            # Log if message_box is somehow not available (e.g., called after chat closed)
-            print(f"[Debug] Message box not available for: {message}")
-
-    # Schedule the insert operation on the main Tkinter thread
-    if root:
+def _flush_pending_messages():
+    """Inserts all queued messages into the message_box in one batch (Tk thread only)."""
+    global _flush_scheduled
+    with _pending_lock:
+        batch = list(_pending_messages)
+        _pending_messages.clear()
+        _flush_scheduled = False
+
+    if not batch: return
+    if _chat_alive and message_box:
         try:
-            # Use after(0) to schedule the call as soon as possible in the event loop
-            root.after(0, _insert)
-        except Exception as e: # Catch potential errors if root is destroyed during scheduling
-            print(f"Error scheduling message display on root: {e}")
+            message_box.configure(state="normal") # Enable writing once for the whole batch
+            # Merge consecutive messages sharing a tag so each run is one insert call
+            run_text, run_tag = [], batch[0][1]
+            for message, tag in batch:
+                if tag != run_tag:
+                    message_box.insert(END, "".join(run_text), run_tag) # Insert text with tag
+                    run_text, run_tag = [], tag
+                run_text.append(message)
+            message_box.insert(END, "".join(run_text), run_tag)
+            # Keep the history bounded: drop the oldest lines once past MAX_CHAT_LINES
+            line_count = int(message_box.index("end-1c").split(".")[0])
+            if line_count > MAX_CHAT_LINES:
+                message_box.delete("1.0", f"{line_count - MAX_CHAT_LINES + 1}.0")
+            message_box.configure(state="disabled") # Disable writing
+            message_box.see(END) # Auto-scroll to the bottom once per batch
+        except Exception as e:
+            # Log error if insertion fails
+            print(f"Error displaying messages: {e}\nBatch size: {len(batch)}")
     else:
+        # Log if message_box is somehow not available (e.g., called after chat closed)
+        for message, _tag in batch:
+            print(f"[Debug] Message box not available for: {message}")
+
+def display_message(message, tag):
+    """Safely displays a message in the message_box from any thread."""
+    global _flush_scheduled
+    if not root:
         # Log if root isn't available for scheduling
         print(f"[Error] Cannot schedule display for message (UI root not ready?): {message}")
+        return
+
+    with _pending_lock:
+        _pending_messages.append((message, tag))
+        if _flush_scheduled: return # A flush is already queued, it will pick this message up
+        _flush_scheduled = True
+
+    # Schedule a single flush on the main Tkinter thread
+    try:
+        # Use after(0) to schedule the call as soon as possible in the event loop
+        root.after(0, _flush_pending_messages)
+    except Exception as e: # Catch potential errors if root is destroyed during scheduling
+        print(f"Error scheduling message display on root: {e}")
+        with _pending_lock:
+            _flush_scheduled = False
 
 # --- Process ANSI ---
+ANSI_PATTERN = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
 def process_ansi_colors(message):
     """Removes ANSI escape codes from a string."""
-    ansi_pattern = r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])'
-    return re.sub(ansi_pattern, '', message)
+    if '\x1b' not in message: return message # Fast path: plain text never needs the regex
+    return ANSI_PATTERN.sub('', message)
 
 # --- Show Help Function (Updated sidebar description) ---
+HELP_MESSAGE = (
+    "--- Client Commands ---\n"
+    " /help             - Shows this help message\n"
+    " /exit             - Disconnects and shows login window\n"
+    " /toggle_sound     - Toggle notification sound on/off\n"
+    "--- Server Commands (Sent to Server) ---\n"
+    " /files <user>     - Lists files uploaded by <user> (updates sidebar)\n"
+    " /download <user> <filename> - Request download of a file from <user>\n"
+    " /upload <path>    - (Or Drag & Drop) Request upload of local file\n"
+    " /delete <filename>- Request deletion of your own uploaded file\n"
+    " /list             - List connected users online\n"
+    "--- Operator Only Commands ---\n"
+    " /delete <user> <fn> - Request deletion of a specific user's file\n"
+    " /kick <user> [reason] - Kick a user from the server\n"
+    " /op <username>      - Make a user an operator\n"
+    " /deop <username>    - Remove operator status\n"
+    " /listops          - List server operators\n"
+    " /stop /restart    - Stop or restart the server (Use with caution!)\n"
+    "-----------------------\n"
+    " Drag & Drop a file onto the chat area to request upload.\n"
+    " Click a filename in the right sidebar (after /files) to request download.\n" # <<< Updated sidebar role
+)
+
 def show_help():
     """Displays available client and server commands in the chat box."""
-    help_message = (
-        "--- Client Commands ---\n"
-        " /help             - Shows this help message\n"
-        " /exit             - Disconnects and shows login window\n"
-        " /toggle_sound     - Toggle notification sound on/off\n"
-        "--- Server Commands (Sent to Server) ---\n"
-        " /files <user>     - Lists files uploaded by <user> (updates sidebar)\n"
-        " /download <user> <filename> - Request download of a file from <user>\n"
-        " /upload <path>    - (Or Drag & Drop) Request upload of local file\n"
-        " /delete <filename>- Request deletion of your own uploaded file\n"
-        " /list             - List connected users online\n"
-        "--- Operator Only Commands ---\n"
-        " /delete <user> <fn> - Request deletion of a specific user's file\n"
-        " /kick <user> [reason] - Kick a user from the server\n"
-        " /op <username>      - Make a user an operator\n"
-        " /deop <username>    - Remove operator status\n"
-        " /listops          - List server operators\n"
-        " /stop /restart    - Stop or restart the server (Use with caution!)\n"
-        "-----------------------\n"
-        " Drag & Drop a file onto the chat area to request upload.\n"
-        " Click a filename in the right sidebar (after /files) to request download.\n" # <<< Updated sidebar role
-    )
-    display_message(help_message, "client_command_output")
+    display_message(HELP_MESSAGE, "client_command_output")
 
 # --- Toggle Sound ---
 def toggle_sound():
@@ -947,6 +1111,7 @@ def toggle_sound():
     global NOTIFICATION_SOUND
     NOTIFICATION_SOUND = not NOTIFICATION_SOUND
     save_sound_setting(NOTIFICATION_SOUND)
+    if NOTIFICATION_SOUND: reset_sound_cache() # Re-check the sound file when turned back on
     status = "enabled" if NOTIFICATION_SOUND else "disabled"
     display_message(f" Notification sound {status}.\n", "client_command_output")
 
@@ -955,6 +1120,7 @@ def toggle_sound():
 def main():
     global root, login_window, ip_entry, port_entry, password_entry, username_entry, user_password_entry, login_button
     global remember_session_checkbox, save_passwords_checkbox # <<< Make new checkbox global
+    global _login_alive
 
     # Use tkinterdnd2 Tk object as the root
     # This provides the necessary DND functionality for the application
@@ -970,7 +1136,7 @@ def main():
     login_window.geometry("350x550")
 
     def on_login_window_close():
-        if not chat_window or not chat_window.winfo_exists():
+        if not _chat_alive or not chat_window:
             print("[Info] Login window closed and no chat window active. Quitting.")
             if root: root.quit()
         else:
@@ -978,6 +1144,8 @@ def main():
             print("[Info] Login window closed, but chat window active. Hiding login.")
             login_window.withdraw()
     login_window.protocol("WM_DELETE_WINDOW", on_login_window_close)
+    login_window.bind("<Destroy>", _on_login_window_destroyed)
+    _login_alive = True
 
     # --- Login Widgets ---
     ctk.CTkLabel(login_window, text="Server IP").pack(pady=(20, 2))
@@ -1016,19 +1184,21 @@ def main():
     # --- Pre-fill from Session ---
     if loaded_session:
         print("[Info] Pre-filling login info from session file.")
-        ip_entry.insert(0, loaded_session.get("ip", ""))
-        port_entry.insert(0, loaded_session.get("port", "5050")) # Default port if missing
-        username_entry.insert(0, loaded_session.get("username", ""))
-        # Check the main remember box if session was loaded
-        remember_session_checkbox.select()
-
-        # --- NEW: Pre-fill Passwords and check password box ---
         server_pass = loaded_session.get("server_password")
         user_pass = loaded_session.get("user_password")
-        if server_pass:
-            password_entry.insert(0, server_pass)
-        if user_pass:
-            user_password_entry.insert(0, user_pass)
+
+        def prefill_entries():
+            """Fills all login entries in one idle callback once the window is mapped."""
+            for entry, value in ((ip_entry, loaded_session.get("ip", "")),
+                                 (port_entry, loaded_session.get("port", "5050")), # Default port if missing
+                                 (username_entry, loaded_session.get("username", "")),
+                                 (password_entry, server_pass),         # --- NEW: Pre-fill Passwords ---
+                                 (user_password_entry, user_pass)):
+                if value: entry.insert(0, value)
+        root.after_idle(prefill_entries)
+
+        # Check the main remember box if session was loaded
+        remember_session_checkbox.select()
 
         # Check the save passwords box ONLY if passwords were found in the session
         if server_pass or user_pass:
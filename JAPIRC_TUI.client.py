@@ -1,6 +1,5 @@
 import curses
 import curses.textpad
-import datetime
 import json
 import os
 import re
@@ -10,37 +9,109 @@ import sys
 import threading
 import time
 import atexit # Import atexit
+import collections
+import itertools
+import functools
+import importlib.util
+import queue
+import selectors
 
-try:
-    # Optional sound dependency
-    from playsound import playsound
-    SOUND_ENABLED = True
-except ImportError:
-    SOUND_ENABLED = False
+# Optional sound dependency; only checked for here, imported on first use by the sound worker
+SOUND_ENABLED = importlib.util.find_spec("playsound") is not None
 
 # --- Configuration Constants ---
 MAX_LENGHT = 512
 CONNECT_TIMEOUT = 10
-INPUT_TIMEOUT = 100 # Milliseconds for non-blocking input check
+USE_TCP_NODELAY = True # Send small packets immediately (lower latency); set False to let Nagle batch them
+SOCKET_BUFFER_SIZE = 1 << 20 # Kernel SO_RCVBUF/SO_SNDBUF request (1 MiB) so file transfers aren't window-limited
+INPUT_TIMEOUT = 100 # Milliseconds for non-blocking input check (fallback where stdin can't be select()ed)
+IDLE_WAKEUP_INTERVAL = 1.0 # Seconds the main loop may sleep in select() with nothing to do
+USE_SELECT_WAIT = os.name != 'nt' # select() on stdin only works on POSIX terminals
 SETTINGS_DIR = os.path.expanduser("./") # Changed to current directory for simplicity
 SOUND_FILE = os.path.join(SETTINGS_DIR, "sound_option.json")
 SESSION_FILE = os.path.join(SETTINGS_DIR, "session.json")
 DOWNLOAD_DIR = os.path.expanduser("~/Downloads")
 NOTIFICATION_SOUND_FILE = 'notification.wav' # Assumed to be in the same dir as the script or configured path
+RECV_BUFFER_SIZE = 65536 # Bytes read per recv_into() call on the chat socket
+FILE_CHUNK_SIZE = 65536 # Max bytes requested per recv_into() while receiving a file
+RECV_WAITALL_FLAG = getattr(socket, "MSG_WAITALL", 0) # Wait for full file chunks where supported (POSIX)
+MAX_MESSAGES = 10_000 # Chat history kept in memory; oldest lines are dropped first
+REDRAW_MIN_INTERVAL = 0.033 # Seconds between redraw wakeups triggered by add_message (~30/sec)
+REDRAW_BATCH_SIZE = 32 # Wake the UI immediately once this many messages are waiting
+BEEP_MIN_INTERVAL = 0.25 # Seconds between bells for invalid keys at the reconnect prompt
+
+# Key code sets checked in the input loops (built once instead of a tuple per keystroke)
+KEYS_YES = frozenset((ord('y'), ord('Y')))
+KEYS_NO = frozenset((ord('n'), ord('N')))
+KEYS_BACKSPACE = frozenset((curses.KEY_BACKSPACE, 127, 8))
+KEYS_ENTER = frozenset((curses.KEY_ENTER, 10, 13))
 
 # --- Global State ---
 CURRENT_USER = ""
 NOTIFICATION_SOUND_ACTIVE = True
 client_socket = None
-messages = []
-message_lock = threading.Lock()
-needs_redraw = threading.Event()
+# Chat history, appended by the receiver thread and the main thread. Changes to it and to the
+# counters that describe it (_system_message_count, _pending_redraw_messages) are made under
+# _history_lock; the main thread draws from snapshot copies (list()/islice), so reads don't lock.
+messages = collections.deque(maxlen=MAX_MESSAGES)
+_history_lock = threading.Lock()
+# Message kinds stored with each entry; /clear keeps MSG_CHAT entries and drops the client's own notices
+MSG_CHAT = "chat"     # Chat lines: user's own messages and text received from the server
+MSG_SYSTEM = "sys"    # Client-side status, errors, help and file notices
+_system_message_count = 0 # MSG_SYSTEM entries added since the last /clear; 0 means /clear has nothing to drop
+class WakeupEvent(threading.Event):
+    """Event that also writes to a pipe on set(), so a select() on the pipe wakes up."""
+    def __init__(self):
+        super().__init__()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+
+    def set(self):
+        # Callers mutate state before calling set(), so if the flag is still up the main loop
+        # hasn't cleared it yet and will see that state; skip the Condition lock and pipe write
+        if self.is_set(): return
+        super().set()
+        try:
+            os.write(self.wake_w, b'\0')
+        except BlockingIOError:
+            pass # Pipe already full: a wakeup is pending anyway
+
+    def drain(self):
+        """Discards pending wakeup bytes."""
+        try:
+            while os.read(self.wake_r, 512): pass
+        except BlockingIOError:
+            pass
+
+needs_redraw = WakeupEvent() if USE_SELECT_WAIT else threading.Event()
 _intentional_exit = False # Flag for intentional exit (e.g., /exit, Ctrl+C)
 _exiting_gracefully = False # Flag to prevent double exit attempts from signal handler
 waiting_for_reconnect_ack = False # NEW: Flag when waiting for user reconnect confirmation
+_pending_redraw_messages = 0 # Messages added since the main loop last redrew
+_last_redraw_signal = 0.0 # time.monotonic() of the last add_message wakeup
+_download_dir_ready = False # Set once DOWNLOAD_DIR has been created
+_last_session = None # Session data from the last successful login, reused on reconnect
+handshake_leftover = b'' # Bytes read past the final login response, handed to the receiver thread
+_chat_rev = 0 # Bumped whenever the chat history changes
+_last_chat_draw = None # (window, rev, scroll_pos, size) of the last redraw_chat pass
+_last_beep_time = 0.0 # time.monotonic() of the last reconnect-prompt bell
+_last_status_draw = None # (window, user, sound state, width) of the last redraw_status pass
 
 # --- Utility Functions ---
 
+_clock_second = None # Last whole second formatted by get_current_time()
+_clock_text = ""     # Its "HH:MM:SS" text
+
+def get_current_time():
+    """Returns the current time formatted as HH:MM:SS, formatting at most once per second."""
+    global _clock_second, _clock_text
+    second = int(time.time())
+    if second != _clock_second:
+        _clock_text = time.strftime("%H:%M:%S", time.localtime(second))
+        _clock_second = second
+    return _clock_text
+
 def ensure_settings_dir():
     """Creates the settings directory if it doesn't exist."""
     os.makedirs(SETTINGS_DIR, exist_ok=True)
@@ -98,7 +169,8 @@ def load_session():
 # Use this feature with extreme caution and only on trusted systems. Consider
 # using OS keyring integration or other secure storage mechanisms in a real application.
 def save_session(ip, port, server_password, username, user_password):
-    """Saves session data including user password to a JSON file."""
+    """Saves session data including user password to a JSON file (and keeps it in memory for reconnects)."""
+    global _last_session
     ensure_settings_dir()
     session_data = {
         "server_ip": ip,
@@ -107,54 +179,124 @@ def save_session(ip, port, server_password, username, user_password):
         "username": username,
         "user_password": user_password      # <<< !!! EXTREME SECURITY RISK !!! >>>
     }
+    _last_session = session_data # Reconnect reuses this instead of re-reading the file
     try:
         with open(SESSION_FILE, "w") as file:
             json.dump(session_data, file, indent=4)
     except IOError:
         pass # Ignore errors saving session
 
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+ANSI_ESCAPE_BYTES = re.compile(ANSI_ESCAPE.pattern.encode()) # Same pattern for raw handshake bytes
+
 def strip_ansi_codes(text):
     """Removes ANSI escape sequences (like colors) from text."""
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
+    # Most lines carry no escapes at all: the 'in' scan is a C-level memchr-style search,
+    # so those lines skip the regex engine (and the cache) and are returned unchanged
+    if '\x1b' not in text:
+        return text
+    return _strip_ansi_escapes(text)
+
+@functools.lru_cache(maxsize=512)
+def _strip_ansi_escapes(text):
+    """Regex path of strip_ansi_codes, memoized for repeated colored lines."""
+    return ANSI_ESCAPE.sub('', text)
+
+_sound_queue = queue.Queue(maxsize=1) # At most one notification waiting behind the one playing
+_sound_worker = None # Single background thread that plays queued notifications
+
+def _sound_worker_loop():
+    """Imports playsound on first use and plays queued notification sounds one at a time."""
+    try:
+        from playsound import playsound
+    except Exception:
+        return # Library present but unusable; notifications are silently dropped
+    while True:
+        sound_file = _sound_queue.get()
+        try:
+            playsound(sound_file)
+        except Exception:
+            pass # Ignore playsound errors silently
 
 def play_notification_sound():
-    """Plays the notification sound in a separate thread if enabled and available."""
+    """Queues the notification sound for the sound worker thread if enabled and available."""
+    global _sound_worker
     if NOTIFICATION_SOUND_ACTIVE and SOUND_ENABLED and os.path.exists(NOTIFICATION_SOUND_FILE):
+        if _sound_worker is None: # Start the worker on the first notification
+            _sound_worker = threading.Thread(target=_sound_worker_loop, daemon=True)
+            _sound_worker.start()
         try:
-            # Run playsound in a separate thread to avoid blocking the UI
-            threading.Thread(target=playsound, args=(NOTIFICATION_SOUND_FILE,), daemon=True).start()
-        except Exception:
-            pass # Ignore playsound errors silently
+            _sound_queue.put_nowait(NOTIFICATION_SOUND_FILE)
+        except queue.Full:
+            pass # A sound is already pending; bursts coalesce into it
 
-def add_message(text, color_pair_index_or_attr, play_sound=True):
+# Characters replaced with '?' before text reaches curses (NUL crashes addstr, the rest garble the screen)
+SANITIZE_TABLE = str.maketrans({'\x00': '?', '\x01': '?', '\x02': '?', '\x07': '?'})
+
+def add_message(text, color_pair_index_or_attr, play_sound=True, kind=MSG_SYSTEM):
     """
     Safely adds a message to the message list and signals UI redraw.
     Accepts either a color pair index (int) or a combined attribute (int).
-    Removes null characters before adding.
+    Replaces null and other unsafe control characters before adding.
     """
-    global messages
+    global _pending_redraw_messages, _last_redraw_signal, _chat_rev, _system_message_count
 
-    # Sanitize the text to remove/replace null bytes which crash curses
+    # Sanitize the text: null bytes crash curses, other control chars garble the display
     if isinstance(text, str): # Ensure it's a string first
-        if '\x00' in text:
-            # Replace null bytes with a placeholder '?'
-            text = text.replace('\x00', '?')
-            # Optionally log this:
-            # print(f"DEBUG: Replaced null byte in message: {repr(text)}", file=sys.stderr)
-
-    with message_lock:
-        # Store the text and its associated attribute (can be color pair index or combined)
-        messages.append((text, color_pair_index_or_attr))
-    needs_redraw.set() # Signal the main loop that the UI needs to be updated
+        text = text.translate(SANITIZE_TABLE) # Replace them with a placeholder '?' in one pass
+
+    # Store the text, its associated attribute (can be color pair index or combined),
+    # an empty per-width word-wrap cache filled in by redraw_chat, and the message kind
+    with _history_lock:
+        messages.append((text, color_pair_index_or_attr, {}, kind))
+        if kind != MSG_CHAT: _system_message_count += 1
+        _pending_redraw_messages += 1
+        _chat_rev += 1
+    # Signal the main loop, throttled so bursts coalesce into one redraw.
+    # Anything held back here is picked up by the main loop's next tick.
+    # Errors (red, color 3) are shown immediately regardless of the throttle.
+    now = time.monotonic()
+    if (color_pair_index_or_attr == 3 or _pending_redraw_messages >= REDRAW_BATCH_SIZE
+            or now - _last_redraw_signal >= REDRAW_MIN_INTERVAL):
+        _last_redraw_signal = now
+        needs_redraw.set()
     if play_sound: # Only play sound if requested (and enabled)
         play_notification_sound()
 
 
+def add_messages(entries, kind=MSG_SYSTEM):
+    """
+    Adds several (text, color_pair_index_or_attr) messages of one kind at once without sound.
+    Extends the history under one lock acquisition and signals a redraw only once for the whole block.
+    """
+    global _pending_redraw_messages, _last_redraw_signal, _chat_rev, _system_message_count
+
+    # Sanitize control characters (see add_message) and attach an empty word-wrap cache to each entry
+    batch = [(text.translate(SANITIZE_TABLE), attr, {}, kind) for text, attr in entries]
+    if not batch: return
+
+    with _history_lock:
+        messages.extend(batch)
+        if kind != MSG_CHAT: _system_message_count += len(batch)
+        _pending_redraw_messages += len(batch)
+        _chat_rev += 1
+    _last_redraw_signal = time.monotonic()
+    needs_redraw.set()
+
+
 # --- Curses UI Functions ---
 
+def wrap_message(msg_text, wrap_cache, width):
+    """Returns msg_text split into width-sized segments, cached per width on the message."""
+    segments = wrap_cache.get(width)
+    if segments is None:
+        segments = [msg_text[start : start + width] for start in range(0, len(msg_text), width)]
+        wrap_cache[width] = segments
+    return segments
+
 def init_colors():
     """Initializes color pairs for the curses UI."""
+    global _ATTR_BY_IDX, _BOLD_ATTR_BY_IDX
     curses.start_color()
     curses.use_default_colors() # Use terminal's default background
     # Define color pairs (foreground, background). -1 means default background.
@@ -165,6 +307,13 @@ def init_colors():
     curses.init_pair(5, curses.COLOR_WHITE, curses.COLOR_BLUE) # Status Bar
     curses.init_pair(6, curses.COLOR_YELLOW, -1)   # Input prompt, Status messages (Maybe Bold)
     curses.init_pair(7, curses.COLOR_WHITE, -1)    # Reconnect prompt color
+    # Resolve each color index to its final attribute once (user's own messages bold)
+    _ATTR_BY_IDX = {i: curses.color_pair(i) | (curses.A_BOLD if i == 1 else 0) for i in range(1, 8)}
+    # Bold variants for prompts and headers, so drawing code never calls color_pair() itself
+    _BOLD_ATTR_BY_IDX = {i: curses.color_pair(i) | curses.A_BOLD for i in range(1, 8)}
+
+_ATTR_BY_IDX = {} # Color pair index -> resolved curses attribute, filled by init_colors
+_BOLD_ATTR_BY_IDX = {} # Color pair index -> same pair with A_BOLD, filled by init_colors
 
 def create_windows(max_y, max_x):
     """Creates the chat, input, and status windows based on terminal size."""
@@ -181,51 +330,102 @@ def create_windows(max_y, max_x):
     status_win = curses.newwin(status_h, max_x, max_y - status_h, 0)
     return chat_win, input_win, status_win
 
+_chat_inner_windows = {} # chat window -> borderless derwin covering the area inside the border
+_chat_shadow_rows = {} # chat window -> [(segment, attr) or None per inner row] as last drawn
+
+def get_inner_window(win):
+    """
+    Returns (and caches) the sub-window covering the area inside win's border.
+    The border itself is drawn once here, when the sub-window is created; later
+    frames only repaint the interior.
+    """
+    inner = _chat_inner_windows.get(win)
+    if inner is None:
+        max_y, max_x = win.getmaxyx()
+        win.erase()
+        win.border()
+        win.noutrefresh() # Stage the border for the next curses.doupdate()
+        inner = win.derwin(max_y - 2, max_x - 2, 1, 1)
+        inner.idlok(True) # Let curses use the terminal's line scrolling when rows shift
+        _chat_inner_windows[win] = inner
+    return inner
+
+def find_row_shift(old_rows, new_rows):
+    """Returns how many rows old_rows must scroll up to line up with new_rows (0 if no such shift)."""
+    first = new_rows[0]
+    if first is None: return 0
+    height = len(new_rows)
+    for shift in range(1, height):
+        if old_rows[shift] == first and old_rows[shift:] == new_rows[:height - shift]:
+            return shift
+    return 0
+
 def redraw_chat(win, scroll_pos):
-    """Redraws the chat window with messages, handling scrolling and word wrap."""
-    win.erase()
-    win.border()
+    """
+    Redraws the chat window with messages, handling scrolling and word wrap.
+    Rows are diffed against what was drawn last time: when new messages push the view
+    up, the interior is scrolled and only rows whose contents changed are rewritten.
+    """
+    global _last_chat_draw
     max_y, max_x = win.getmaxyx()
+    # Nothing to do if the history, scroll position and window are unchanged since the last pass
+    draw_state = (win, _chat_rev, scroll_pos, (max_y, max_x))
+    if draw_state == _last_chat_draw: return
+    _last_chat_draw = draw_state
+
     inner_h, inner_w = max_y - 2, max_x - 2 # Available space inside border
     if inner_h <= 0 or inner_w <= 0: return # Cannot draw if too small
+    inner = get_inner_window(win)
+
+    # Calculate which messages to display based on scroll position
+    end_index = len(messages) - scroll_pos
+    start_index = max(0, end_index - inner_h) # Show the last 'inner_h' messages
+    # Snapshot the visible slice; list(islice(...)) runs in C under the GIL, so the
+    # receiver thread's appends can't interleave with the copy
+    display_msgs = list(itertools.islice(messages, start_index, end_index))
+
+    # Lay out the visible rows top-down as (segment, attr), clipped at the bottom edge
+    rows = []
+    for msg_text, attr_or_color_idx, wrap_cache, _kind in display_msgs:
+        # Determine the attribute to use: a color index resolves through the table built in
+        # init_colors, a combined attribute (e.g., _BOLD_ATTR_BY_IDX[4]) is used as-is
+        attr = _ATTR_BY_IDX.get(attr_or_color_idx, attr_or_color_idx)
+        rows.extend((segment, attr) for segment in wrap_message(msg_text, wrap_cache, inner_w))
+        if len(rows) >= inner_h: break # Stop if window is full
+    del rows[inner_h:]
+    rows.extend([None] * (inner_h - len(rows))) # Empty rows below the last message
+
+    old_rows = _chat_shadow_rows.get(win)
+    if old_rows is None or len(old_rows) != inner_h:
+        inner.erase() # Nothing usable on screen yet: draw every row
+        old_rows = [None] * inner_h
+    else:
+        shift = find_row_shift(old_rows, rows)
+        if shift: # New messages pushed the view up: move what's already drawn instead of redrawing it
+            inner.scrollok(True)
+            inner.scroll(shift)
+            inner.scrollok(False) # Keep writes to the bottom-right cell from scrolling
+            old_rows = old_rows[shift:] + [None] * shift
+
+    for row_num, (row, old_row) in enumerate(zip(rows, old_rows)):
+        if row == old_row: continue # Row already shows this content
+        inner.move(row_num, 0)
+        inner.clrtoeol()
+        if row is None: continue
+        try:
+            inner.addstr(row_num, 0, row[0], row[1])
+        except curses.error:
+            # Raised when the text ends in the bottom-right cell (it is still drawn)
+            pass
+    _chat_shadow_rows[win] = rows
+
+    inner.noutrefresh() # Stage for the next curses.doupdate()
 
-    with message_lock:
-        # Calculate which messages to display based on scroll position
-        end_index = len(messages) - scroll_pos
-        start_index = max(0, end_index - inner_h) # Show the last 'inner_h' messages
-        display_msgs = messages[start_index:end_index]
-        line_num = 1 # Start drawing from the first line inside the border
-
-        for msg_text, attr_or_color_idx in display_msgs:
-            # Determine the attribute to use. If it's just an index, get the color pair.
-            # If it already includes attributes (like A_BOLD), use it directly.
-            if isinstance(attr_or_color_idx, int) and attr_or_color_idx < 256: # Heuristic: likely a color index
-                attr = curses.color_pair(attr_or_color_idx)
-                # Apply default bolding based on color index if needed (example)
-                if attr_or_color_idx == 1: attr |= curses.A_BOLD # User's own messages bold
-                # elif attr_or_color_idx == 4: attr |= curses.A_BOLD # Example: Make info bold
-            else: # It's likely already a combined attribute (e.g., curses.color_pair(4) | curses.A_BOLD)
-                attr = attr_or_color_idx
-
-            # Simple word wrapping (split message into lines that fit inner_w)
-            start = 0
-            while start < len(msg_text):
-                if line_num > inner_h: break # Stop if window is full
-                segment = msg_text[start : start + inner_w]
-                try:
-                    # Add the text segment to the window at the current line
-                    win.addstr(line_num, 1, segment, attr)
-                except curses.error:
-                    # Ignore error if text doesn't fit exactly at line end (can happen)
-                    pass
-                line_num += 1
-                start += inner_w # Move to the next segment start
-            if line_num > inner_h: break # Stop outer loop if window full
-
-    win.refresh() # Update the physical screen
-
-def redraw_input(win, current_input_text):
-    """Redraws the input window with the prompt and current user input OR the reconnect prompt."""
+def redraw_input(win, current_input_bytes):
+    """
+    Redraws the input window with the prompt and current user input OR the reconnect prompt.
+    The input is kept as raw typed bytes and decoded (UTF-8) only for display.
+    """
     global waiting_for_reconnect_ack
     win.erase()
     win.border()
@@ -236,7 +436,7 @@ def redraw_input(win, current_input_text):
     if waiting_for_reconnect_ack:
         prompt_text = "Reconnect? (y/n) "
         prompt_len = len(prompt_text)
-        prompt_attr = curses.color_pair(7) | curses.A_BOLD # White, Bold
+        prompt_attr = _BOLD_ATTR_BY_IDX[7] # White, Bold
 
         try:
             # Display the reconnect prompt
@@ -252,14 +452,14 @@ def redraw_input(win, current_input_text):
         input_width = max_x - 2 - prompt_len # Available width for typing
         if input_width <= 0: return # Cannot draw input area if too narrow
 
-        text_to_display = current_input_text or ""
+        text_to_display = current_input_bytes.decode("utf-8", errors="replace")
         # Calculate start position to show the end of the text if it's too long
         start_pos = max(0, len(text_to_display) - input_width)
         display_text = text_to_display[start_pos:]
 
         try:
             # Draw prompt (Yellow, Bold)
-            win.addstr(inner_y, inner_x, prompt, curses.color_pair(6) | curses.A_BOLD)
+            win.addstr(inner_y, inner_x, prompt, _BOLD_ATTR_BY_IDX[6])
             # Draw user input text (Default terminal color)
             win.addstr(inner_y, inner_x + prompt_len, display_text)
             # Move cursor to the end of the input text visually
@@ -267,17 +467,23 @@ def redraw_input(win, current_input_text):
         except curses.error:
             pass # Ignore drawing errors if terminal is squeezing
 
-    win.refresh()
+    win.noutrefresh() # Stage for the next curses.doupdate()
 
 
 def redraw_status(win):
-    """Redraws the status bar at the bottom."""
-    global NOTIFICATION_SOUND_ACTIVE, CURRENT_USER
-    win.erase()
+    """Redraws the status bar at the bottom (only when its contents or size changed)."""
+    global NOTIFICATION_SOUND_ACTIVE, CURRENT_USER, _last_status_draw
     max_y, max_x = win.getmaxyx()
     sound_state = "ON" if NOTIFICATION_SOUND_ACTIVE else "OFF"
     if not SOUND_ENABLED: sound_state = "N/A"
 
+    # The status line only depends on the user, sound state and width; skip rebuilding it otherwise
+    draw_state = (win, CURRENT_USER, sound_state, max_x)
+    if draw_state == _last_status_draw: return
+    _last_status_draw = draw_state
+
+    win.erase()
+
     left_text = f" User: {CURRENT_USER or '???'}"
     # Updated status bar text
     right_text = f"Sound: {sound_state} | /help | PgUp/PgDn Scroll | Ctrl+C Exit "
@@ -286,18 +492,23 @@ def redraw_status(win):
     status_text = f"{left_text}{right_text.rjust(max_x - len(left_text))}"[:max_x]
 
     try:
-        status_attr = curses.color_pair(5) # White on Blue background pair
+        status_attr = _ATTR_BY_IDX[5] # White on Blue background pair
         # Apply background color to the whole line and add text
         win.bkgd(' ', status_attr)
         win.addstr(0, 0, status_text, status_attr)
     except curses.error:
         pass # Ignore drawing errors
 
-    win.refresh()
+    win.noutrefresh() # Stage for the next curses.doupdate()
 
 def resize_ui(stdscr, chat_win, input_win, status_win):
     """Handles terminal resize events by recreating windows."""
     max_y, max_x = stdscr.getmaxyx()
+    _chat_inner_windows.clear() # Old chat windows (and their sub-windows) are replaced
+    _chat_shadow_rows.clear()
+    # Wrapped segments for the old width are useless now (iterate over a snapshot copy)
+    for _text, _attr, wrap_cache, _kind in list(messages):
+        wrap_cache.clear()
     stdscr.clear() # Clear the main screen
     stdscr.refresh() # Refresh to apply clear
 
@@ -319,36 +530,56 @@ def resize_ui(stdscr, chat_win, input_win, status_win):
 
 # --- Network and Logic Functions ---
 
-def handle_received_file(sock, filename, file_size):
-    """Handles receiving a file chunk by chunk directly from the socket."""
+def handle_received_file(sock, filename, file_size, pending):
+    """
+    Handles receiving a file chunk by chunk directly from the socket.
+    File bytes already buffered in 'pending' (read together with the header) are
+    consumed first; the socket is never read past the end of the file.
+    """
+    global _download_dir_ready
     save_path = None # Define outside try block for cleanup
     try:
         filename = os.path.basename(filename) # Basic security: prevent directory traversal
         # Use Green (4) for download messages, no sound initially
         add_message(f"⬇️ Receiving file: {filename} ({file_size} bytes)...", 4, play_sound=False)
-        os.makedirs(DOWNLOAD_DIR, exist_ok=True) # Ensure download directory exists
+        if not _download_dir_ready: # Ensure download directory exists (checked once per session)
+            os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+            _download_dir_ready = True
         save_path = os.path.join(DOWNLOAD_DIR, filename)
 
-        # Check for existing file and notify (Red=3, no sound)
-        if os.path.exists(save_path):
-            add_message(f"⚠️ Overwriting existing file: {filename}", 3, play_sound=False)
-
         bytes_received = 0
-        with open(save_path, "wb") as f:
+        try:
+            f = open(save_path, "xb") # Create exclusively; fails only if the file already exists
+        except FileExistsError:
+            # Notify about the existing file (Red=3, no sound) and overwrite it
+            add_message(f"⚠️ Overwriting existing file: {filename}", 3, play_sound=False)
+            f = open(save_path, "wb")
+        with f:
+            # Start with any file data that arrived in the same read as the header
+            buffered = min(len(pending), file_size)
+            if buffered:
+                f.write(pending[:buffered])
+                del pending[:buffered]
+                bytes_received = buffered
+
+            # Preallocated chunk buffer: file data goes socket -> buffer -> file without new bytes objects
+            chunk_view = memoryview(bytearray(FILE_CHUNK_SIZE))
             while bytes_received < file_size:
-                # Calculate chunk size, request up to 4096 bytes
-                chunk_size = min(4096, file_size - bytes_received)
+                # Calculate chunk size, request up to FILE_CHUNK_SIZE bytes
+                chunk_size = min(FILE_CHUNK_SIZE, file_size - bytes_received)
                 if chunk_size <= 0: break # Should not happen if file_size is correct
 
-                # *** CRITICAL: This recv() is now happening in the receiver thread context ***
-                chunk = sock.recv(chunk_size)
+                # *** CRITICAL: This recv_into() is now happening in the receiver thread context ***
+                # MSG_WAITALL lets the kernel fill the whole chunk before returning; a signal can
+                # still cut it short, which the loop handles like any other partial read
+                n = sock.recv_into(chunk_view[:chunk_size], chunk_size, RECV_WAITALL_FLAG)
 
-                if not chunk:
+                if not n:
                     # Handle unexpected connection close during transfer
                     raise ConnectionError("Connection lost during file transfer.")
 
-                f.write(chunk)
-                bytes_received += len(chunk)
+                f.write(chunk_view[:n])
+                bytes_received += n
                 # Optional: Add a progress indicator message here if desired
                 # e.g., add_message(f"Downloading {filename}: {bytes_received}/{file_size} bytes", 4, play_sound=False)
                 # Be careful not to flood the message queue with progress updates.
@@ -374,119 +605,118 @@ def handle_received_file(sock, filename, file_size):
 
 
 # --- MODIFIED receive_messages_thread (for /files formatting) ---
-def receive_messages_thread(sock):
-    """Thread target function to continuously receive messages or handle file transfers."""
+def add_file_list(header_line):
+    """Adds a 'FILE_LIST:<user>:<file1;file2;...>' line to the chat as a formatted block."""
+    parts = header_line.strip().split(":", 2) # FILE_LIST : username : payload
+    if len(parts) != 3:
+        add_message(f"Received malformed FILE_LIST header: {header_line}", 3, play_sound=False)
+        return
+
+    _list_command, username, payload = parts
+    username = username.strip()
+    payload = payload.strip()
+
+    # Format the header (Green, Bold)
+    header = f"----Files of {username}----"
+    header_attr = _BOLD_ATTR_BY_IDX[4]
+    block = [(header, header_attr)]
+
+    # Process payload (split by semicolon)
+    for fname in payload.split(';'):
+        fname = fname.strip()
+        if fname:
+            # Indented filename (Green, Normal weight)
+            block.append((f" {fname}", 4))
+
+    # Format the footer (Green, Bold), then add the whole listing at once
+    block.append(("-" * len(header), header_attr)) # Match header length
+    add_messages(block)
+
+def handle_file_transfer_line(sock, line_bytes, pending):
+    """Handles a 'FILE_TRANSFER:<name>:<size>' header; the binary payload follows it."""
+    try:
+        header_str = line_bytes.decode('utf-8', errors='replace')
+        _, filename, file_size_str = header_str.split(":", 2)
+        file_size = int(file_size_str)
+    except (ValueError, IndexError):
+        add_message(f"Received malformed FILE_TRANSFER header: {line_bytes!r}", 3, play_sound=False)
+        return
+    try:
+        handle_received_file(sock, filename, file_size, pending)
+    except Exception as file_e:
+        add_message(f"Error during file transfer processing: {file_e}", 3, play_sound=False)
+
+def handle_file_list_line(sock, line_bytes, pending):
+    """Handles a 'FILE_LIST:<user>:<files>' line."""
+    try:
+        add_file_list(line_bytes.decode("utf-8", errors='replace'))
+    except Exception as e:
+        add_message(f"Error processing FILE_LIST message: {e}", 3, play_sound=False)
+
+# Special server lines, keyed on everything up to and including their first ':'.
+# Chat lines start with a timestamp ("HH:"), so they miss with a single dict lookup.
+LINE_PREFIX_HANDLERS = {
+    b"FILE_TRANSFER:": handle_file_transfer_line,
+    b"FILE_LIST:": handle_file_list_line,
+}
+
+def add_incoming_lines(lines):
+    """Adds a block of regular incoming text lines to the chat."""
+    # Remove any server-side color codes and skip empty lines
+    lines = [line for line in map(strip_ansi_codes, lines) if line]
+    if len(lines) == 1:
+        # Use cyan (color 2) for standard incoming messages, sound only for single-line messages
+        add_message(lines[0], 2, kind=MSG_CHAT)
+    else:
+        add_messages(((line, 2) for line in lines), kind=MSG_CHAT)
+
+def receive_messages_thread(sock, initial_data=b''):
+    """
+    Thread target function to continuously receive messages or handle file transfers.
+    The server terminates every message with a newline. Incoming data is framed against
+    a persistent 'pending' buffer: only complete lines are processed and a partial
+    line is carried over to the next read. 'initial_data' holds bytes the login
+    handshake already read past its final response.
+    """
     global _intentional_exit
+    # Preallocated receive buffer reused for every read (no per-recv bytes object)
+    recv_buffer = bytearray(RECV_BUFFER_SIZE)
+    recv_view = memoryview(recv_buffer)
+    pending = bytearray(initial_data) # Received data not yet processed (carries partial lines over)
+    skip_read = bool(pending) # Process handshake leftovers before the first read
     while True:
         try:
-            # Read data from the socket.
-            message_bytes = sock.recv(2048) # Adjust buffer size if needed
-            if not message_bytes:
-                # Server closed the connection
-                if not _intentional_exit:
-                    add_message("Connection closed by server.", 3, play_sound=False)
-                break # Exit the receiving thread
-
-            # --- Decode potential first line for checks ---
-            lines_bytes = message_bytes.split(b'\n', 1)
-            potential_header_line_bytes = lines_bytes[0].strip()
-            remaining_bytes = lines_bytes[1] if len(lines_bytes) > 1 else b""
-
-            # --- Check for File Transfer FIRST ---
-            is_file_transfer = False
-            filename = ""
-            file_size = 0
-            if potential_header_line_bytes.startswith(b"FILE_TRANSFER:"):
-                try:
-                    header_str = potential_header_line_bytes.decode('utf-8', errors='replace')
-                    _, filename, file_size_str = header_str.split(":", 2)
-                    file_size = int(file_size_str)
-                    is_file_transfer = True
-                except (UnicodeDecodeError, ValueError, IndexError):
-                    is_file_transfer = False # Invalid header
-
-            if is_file_transfer:
-                try:
-                    # Call handle_received_file directly
-                    handle_received_file(sock, filename, file_size)
-                    # Note: Any data received *with* the header (remaining_bytes) is currently discarded.
-                    # A more robust protocol/handler would buffer this.
-                    continue # Go back to the start of the loop
-                except Exception as file_e:
-                    add_message(f"Error during file transfer processing: {file_e}", 3, play_sound=False)
+            if skip_read:
+                skip_read = False
+            else:
+                # Read data from the socket straight into the reusable buffer.
+                bytes_read = sock.recv_into(recv_view)
+                if not bytes_read:
+                    # Server closed the connection
+                    if not _intentional_exit:
+                        add_message("Connection closed by server.", 3, play_sound=False)
+                    break # Exit the receiving thread
+                pending += recv_view[:bytes_read]
+
+            # --- Process every complete line in the buffer ---
+            text_lines = [] # Consecutive regular lines, added as one block
+            while True:
+                newline_index = pending.find(b'\n')
+                if newline_index == -1: break # Partial line: wait for more data
+                line_bytes = bytes(pending[:newline_index]).strip()
+                del pending[:newline_index + 1]
+
+                # --- Special lines (FILE_TRANSFER / FILE_LIST): one lookup on the text up to the first ':' ---
+                handler = LINE_PREFIX_HANDLERS.get(line_bytes[:line_bytes.find(b':') + 1])
+                if handler:
+                    add_incoming_lines(text_lines); text_lines = []
+                    handler(sock, line_bytes, pending)
                     continue
 
-            # --- Check for File List (If Not File Transfer) ---
-            is_file_list = False
-            if potential_header_line_bytes.startswith(b"FILE_LIST:"):
-                is_file_list = True
-
-            if is_file_list:
-                try:
-                    # Decode the first line (header)
-                    header_line = potential_header_line_bytes.decode("utf-8", errors='replace')
-                    parts = header_line.strip().split(":", 2) # FILE_LIST : username : payload
-
-                    if len(parts) == 3:
-                        _list_command, username, payload = parts
-                        username = username.strip()
-                        payload = payload.strip()
-
-                        # Format and add the header (Green, Bold)
-                        header = f"----Files of {username}----"
-                        header_attr = curses.color_pair(4) | curses.A_BOLD
-                        add_message(header, header_attr, play_sound=False)
-
-                        # Process payload from the header line (split by semicolon)
-                        if payload:
-                            filenames_on_header = payload.split(';')
-                            for fname in filenames_on_header:
-                                fname = fname.strip()
-                                if fname:
-                                    # Add indented filename (Green, Normal weight)
-                                    add_message(f" {fname}", 4, play_sound=False)
-
-                        # Process any remaining data received in the same chunk (split by newline, then semicolon)
-                        if remaining_bytes:
-                            remaining_text = remaining_bytes.decode("utf-8", errors='replace')
-                            extra_lines = remaining_text.splitlines()
-                            for line in extra_lines:
-                                line = line.strip()
-                                if line:
-                                    filenames_on_line = line.split(';')
-                                    for fname in filenames_on_line:
-                                        fname = fname.strip()
-                                        if fname:
-                                            # Add indented filename (Green, Normal weight)
-                                            add_message(f" {fname}", 4, play_sound=False)
-
-                        # Format and add the footer (Green, Bold)
-                        footer = "-" * len(header) # Match header length
-                        footer_attr = curses.color_pair(4) | curses.A_BOLD
-                        add_message(footer, footer_attr, play_sound=False)
-
-                        needs_redraw.set() # Ensure UI updates
-                        continue # Handled, skip default message handling for this block
-                    else:
-                        # Invalid FILE_LIST format, fall through to default handling below
-                        add_message(f"Received malformed FILE_LIST header: {header_line}", 3, play_sound=False)
-
-                except Exception as e:
-                    add_message(f"Error processing FILE_LIST message: {e}", 3, play_sound=False)
-                    # Fall through to default handling for the original bytes
-
-            # --- Default Message Handling (If Not File Transfer or File List) ---
-            # Decode the entire received data (or what's left after potential header processing)
-            message = message_bytes.decode("utf-8", errors='replace') # Replace undecodable bytes
-            message = strip_ansi_codes(message) # Remove any server-side color codes
-            lines = message.splitlines()
-            play_sound_for_message = len(lines) <= 1 # Only play sound for single-line messages
-
-            for line in lines:
-                if line: # Add non-empty lines
-                    # Use cyan (color 2) for standard incoming messages
-                    add_message(line, 2, play_sound=play_sound_for_message)
-                    play_sound_for_message = False # Only play for the first line of a multi-line block
+                # --- Default Message Handling ---
+                text_lines.append(line_bytes.decode("utf-8", errors='replace')) # Replace undecodable bytes
+
+            add_incoming_lines(text_lines)
 
         # --- Exception Handling for the Loop ---
         except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as net_err:
@@ -506,60 +736,69 @@ def receive_messages_thread(sock):
                 # import traceback; traceback.print_exc() # Uncomment for debugging
             break # Exit thread on unexpected errors
 
+    needs_redraw.set() # Wake the main loop so it notices this thread has exited
+
 # --- End of receive_messages_thread ---
 
 
 def show_client_help():
     """Adds the client and server command help text to the chat display."""
     help_lines = [
-        ("--- Client Help ---", curses.color_pair(4) | curses.A_BOLD), # Green Bold Header
+        ("--- Client Help ---", _BOLD_ATTR_BY_IDX[4]), # Green Bold Header
         (" /help         - Show this help message", 4),                 # Green
         (" /clear        - Clear non-user/server messages", 4),
         (" /clearall     - Clear ALL messages from chat", 4),
         (" /toggle_sound - Toggle notification sound on/off", 4),
         (" /status       - Show current user and sound status", 4),
         (" /exit         - Disconnect from the server", 4),
-        ("--- Server Commands (Sent to Server) ---", curses.color_pair(4) | curses.A_BOLD),
+        ("--- Server Commands (Sent to Server) ---", _BOLD_ATTR_BY_IDX[4]),
         (" /list         - List connected users", 4),
         (" /files <user> - List files uploaded by <user>", 4),
         (" /upload <path>- Request to upload a file (Server support needed)", 4),
         (" /download <user> <filename> - Request to download a file", 4),
         (" /delete <filename> - Request deletion of your own file", 4),
-        ("--- Operator Only Server Commands ---", curses.color_pair(4) | curses.A_BOLD),
+        ("--- Operator Only Server Commands ---", _BOLD_ATTR_BY_IDX[4]),
         (" /kick <user> [reason]", 4),
         (" /op <user>", 4),
         (" /deop <user>", 4),
         (" /listops", 4),
         (" /delete <user> <filename>", 4),
         (" /stop /restart", 4),
-        ("--- TUI Navigation ---", curses.color_pair(4) | curses.A_BOLD),
+        ("--- TUI Navigation ---", _BOLD_ATTR_BY_IDX[4]),
         (" PgUp / PgDn   - Scroll chat history", 4),
         (" Ctrl+C        - Force quit the client (tries graceful exit)", 4),
-        ("-------------------", curses.color_pair(4) | curses.A_BOLD) # Green Bold Footer
+        ("-------------------", _BOLD_ATTR_BY_IDX[4]) # Green Bold Footer
     ]
-    # Add each line with its specified attribute and no sound
-    for line, attr in help_lines:
-        add_message(line, attr, play_sound=False)
+    # Add all lines with their specified attributes in one block (no sound)
+    add_messages(help_lines)
 
 
 def process_user_command(command_text, sock):
     """Handles purely client-side commands OR sends others to the server."""
-    global NOTIFICATION_SOUND_ACTIVE, messages, _intentional_exit # Access globals
+    global NOTIFICATION_SOUND_ACTIVE, _intentional_exit, _chat_rev, _system_message_count # Access globals
 
     parts = command_text.strip().split(" ", 1)
     command = parts[0].lower()
 
     # --- Purely Client-Side Commands ---
     if command == "/clear":
-        with message_lock:
-            # Keep only user's own messages (color 1, bold) and incoming (color 2)
-            messages[:] = [msg for msg in messages if msg[1] == (curses.color_pair(1) | curses.A_BOLD) or msg[1] == curses.color_pair(2)]
+        # Keep only chat lines (user's own and incoming), filtered in place under the history lock
+        # so a line the receiver adds meanwhile is neither lost nor miscounted. Skipped when there's nothing to drop.
+        with _history_lock:
+            if _system_message_count:
+                kept = [msg for msg in messages if msg[3] == MSG_CHAT]
+                messages.clear()
+                messages.extend(kept)
+                _system_message_count = 0
+                _chat_rev += 1
         add_message("Client-side messages cleared.", 6, play_sound=False) # Yellow status
         needs_redraw.set()
         return True # Continue running client
     elif command == "/clearall":
-        with message_lock:
+        with _history_lock:
             messages.clear()
+            _system_message_count = 0
+            _chat_rev += 1
         add_message("All messages cleared.", 6, play_sound=False) # Yellow status
         needs_redraw.set()
         return True # Continue running client
@@ -593,8 +832,9 @@ def process_user_command(command_text, sock):
             return True # Cannot send command, but client keeps running
 
         try:
-            # Send the raw command text to the server
-            sock.sendall(command_text.encode("utf-8"))
+            # Send the command text to the server as one newline-terminated payload
+            payload = command_text.encode("utf-8") + b'\n'
+            sock.sendall(payload)
 
             # If the command was /exit, signal loop termination *after* sending
             if command == "/exit":
@@ -620,8 +860,61 @@ def process_user_command(command_text, sock):
             return True
 
 
+# Handshake rounds before the password/registration step: (credential, label, hide input)
+AUTH_PROMPT_STEPS = (
+    ("server_password", "server password", True),
+    ("username", "username", False), # Echo username
+)
+
+_handshake_view = memoryview(bytearray(1024)) # Reusable receive buffer for the login handshake (main thread only)
+
+def recv_prompt(sock, buffer, delim=b'\n'):
+    """
+    Returns the next delim-terminated handshake line from sock (delimiter removed),
+    keeping any bytes after it in 'buffer' for the next call.
+    Returns b'' if the server closed the connection before a full line arrived.
+    A server that stays silent past the socket's timeout is reported as a connection error.
+    """
+    end = buffer.find(delim)
+    while end == -1:
+        try:
+            n = sock.recv_into(_handshake_view)
+        except socket.timeout:
+            raise ConnectionAbortedError(f"Server did not respond within {sock.gettimeout():g}s during login.") from None
+        if not n:
+            return b''
+        buffer += _handshake_view[:n]
+        end = buffer.find(delim)
+    line = bytes(buffer[:end])
+    del buffer[:end + len(delim)]
+    return line
+
+def decode_prompt(data):
+    """Decodes a handshake line, stripping ANSI codes on the raw bytes before decoding."""
+    if b'\x1b' in data:
+        data = ANSI_ESCAPE_BYTES.sub(b'', data)
+    return data.decode("utf-8", errors='replace').strip()
+
+def configure_socket(sock):
+    """Tunes a new socket for interactive chat traffic. Call before connect() so the buffer sizes shape the TCP window."""
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try: sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+        except OSError: pass # The OS may clamp or refuse the size; its default is still usable
+    try:
+        if USE_TCP_NODELAY:
+            # Disable Nagle so small chat lines and commands are sent immediately instead of being held back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Let the OS probe idle connections so a half-open link is detected instead of hanging
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    except OSError:
+        pass # Not fatal: the connection still works with default options
+
 def send_message(sock, text):
-    """Sends a regular message OR calls command processor."""
+    """
+    Sends a regular message OR calls command processor.
+    The socket has TCP_NODELAY set (see configure_socket), so short messages and
+    commands like /help or /list go out immediately.
+    """
     if not text: return True # Do nothing if input is empty
 
     if text.startswith("/"):
@@ -640,13 +933,12 @@ def send_message(sock, text):
             add_message(f"Message too long (max {MAX_LENGHT} chars). Not sent.", 3, play_sound=False) # Red error
             return True # Continue running
 
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        display_msg = f"{timestamp} [{CURRENT_USER}]: {text}"
+        display_msg = f"{get_current_time()} [{CURRENT_USER}]: {text}"
         # Add user's own message (Magenta=1, Bold), no sound for own messages
-        add_message(display_msg, curses.color_pair(1) | curses.A_BOLD, play_sound=False)
+        add_message(display_msg, 1, play_sound=False, kind=MSG_CHAT) # Color 1 resolves to bold magenta
 
         try:
-            sock.sendall(text.encode("utf-8"))
+            sock.sendall(f"{text}\n".encode("utf-8")) # Newline-terminated, encoded once, one sendall per message
             return True # Message sent successfully, continue running
         except OSError as e:
             add_message(f"Error sending message: {e}", 3, play_sound=False)
@@ -701,7 +993,7 @@ def attempt_connection(stdscr, ip, port, server_pw_saved, username_saved, user_p
     Returns the connected socket on success, None on failure.
     'auto_reconnect' flag influences password prompting logic.
     """
-    global CURRENT_USER, needs_redraw # We need to set CURRENT_USER on successful login
+    global CURRENT_USER, needs_redraw, handshake_leftover # We need to set CURRENT_USER on successful login
 
     sock = None
     # Use copies of saved credentials
@@ -723,66 +1015,56 @@ def attempt_connection(stdscr, ip, port, server_pw_saved, username_saved, user_p
         add_message(f"Connecting to {ip}:{port}...", 6, play_sound=False)
         needs_redraw.set()
         if stdscr:
-            try: stdscr.refresh()
+            try: stdscr.noutrefresh() # Staged; flushed with one doupdate when the attempt finishes
             except: pass
-        time.sleep(0.1)
 
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        configure_socket(sock)
         sock.settimeout(CONNECT_TIMEOUT)
-        sock.connect((ip, port))
-        sock.settimeout(None) # Switch to blocking after connection
+        sock.connect((ip, port)) # CONNECT_TIMEOUT stays on for the handshake so a silent server can't hang it
+        handshake_buffer = bytearray() # Handshake bytes received but not yet consumed
         add_message("Connected. Authenticating...", 6, play_sound=False)
         needs_redraw.set()
         if stdscr:
-            try: stdscr.refresh()
+            try: stdscr.noutrefresh()
             except: pass
 
         # --- Authentication/Registration Steps ---
 
-        # 1. Server Password
-        server_prompt_bytes = sock.recv(1024)
-        if not server_prompt_bytes: raise ConnectionAbortedError("Server closed connection (before server password prompt).")
-        server_prompt = server_prompt_bytes.decode("utf-8", errors='replace').strip()
-
-        # Prompt only if not provided AND NOT auto-reconnecting
-        if not temp_server_pw and not auto_reconnect:
-            if not stdscr: raise RuntimeError("stdscr required for password prompt.")
-            temp_server_pw = get_string_input(stdscr, curses.LINES - 1, strip_ansi_codes(server_prompt), is_password=True)
-            needs_redraw.set() # Redraw whole UI after prompt clears
-        elif not temp_server_pw and auto_reconnect:
-            # Should have been caught by the initial check, but safeguard here.
-            raise ConnectionAbortedError("Auto-reconnect failed: Missing server password.")
-
-        sock.sendall(temp_server_pw.encode("utf-8"))
-
-        # 2. Username
-        user_prompt_bytes = sock.recv(1024)
-        if not user_prompt_bytes: raise ConnectionAbortedError("Server closed connection (before username prompt).")
-        user_prompt = user_prompt_bytes.decode("utf-8", errors='replace').strip()
-
-        # Prompt only if not provided AND NOT auto-reconnecting
-        if not temp_username and not auto_reconnect:
-            if not stdscr: raise RuntimeError("stdscr required for username prompt.")
-            temp_username = get_string_input(stdscr, curses.LINES - 1, strip_ansi_codes(user_prompt), is_password=False) # Echo username
-            needs_redraw.set()
-        elif not temp_username and auto_reconnect:
-            # Should have been caught, safeguard.
-            raise ConnectionAbortedError("Auto-reconnect failed: Missing username.")
-
-        sock.sendall(temp_username.encode("utf-8"))
+        # 1-2. Server password, then username: each round is recv prompt -> ask if needed -> send.
+        # The server reads every answer with its own recv(), so rounds can't be pipelined.
+        credentials = {"server_password": temp_server_pw, "username": temp_username}
+        for field, label, is_password in AUTH_PROMPT_STEPS:
+            prompt_bytes = recv_prompt(sock, handshake_buffer)
+            if not prompt_bytes: raise ConnectionAbortedError(f"Server closed connection (before {label} prompt).")
+            prompt = decode_prompt(prompt_bytes)
+
+            # Prompt only if not provided AND NOT auto-reconnecting
+            value = credentials[field]
+            if not value and not auto_reconnect:
+                if not stdscr: raise RuntimeError(f"stdscr required for {label} prompt.")
+                value = get_string_input(stdscr, curses.LINES - 1, prompt, is_password=is_password)
+                needs_redraw.set() # Redraw whole UI after prompt clears
+            elif not value and auto_reconnect:
+                # Should have been caught by the initial check, but safeguard here.
+                raise ConnectionAbortedError(f"Auto-reconnect failed: Missing {label}.")
+
+            credentials[field] = value
+            sock.sendall(value.encode("utf-8"))
+        temp_server_pw, temp_username = credentials["server_password"], credentials["username"]
         # Don't set global CURRENT_USER until login/registration is confirmed successful
 
         # 3. Receive Next Prompt (Could be for Password or Registration)
-        next_prompt_bytes = sock.recv(1024)
+        next_prompt_bytes = recv_prompt(sock, handshake_buffer)
         if not next_prompt_bytes: raise ConnectionAbortedError("Server closed connection (before user password/registration prompt).")
-        next_prompt = next_prompt_bytes.decode("utf-8", errors='replace').strip()
+        next_prompt = decode_prompt(next_prompt_bytes)
 
         # --- Check if it's a Registration prompt ---
         if "new_password:new_password" in next_prompt:
             # --- REGISTRATION PATH ---
             add_message("Username not found on server. Registering...", 6, play_sound=False)
             needs_redraw.set()
-            if stdscr: stdscr.refresh()
+            if stdscr: stdscr.noutrefresh()
 
             if auto_reconnect:
                 # This shouldn't happen if credentials were correct for auto-reconnect
@@ -839,7 +1121,7 @@ def attempt_connection(stdscr, ip, port, server_pw_saved, username_saved, user_p
                     raise ConnectionAbortedError("Auto-reconnect logic error: Tried to prompt for login password.")
                 if not stdscr: raise RuntimeError("stdscr required for user password prompt.")
                 # Use the prompt we received from the server
-                login_password_to_send = get_string_input(stdscr, curses.LINES - 1, strip_ansi_codes(next_prompt), is_password=True)
+                login_password_to_send = get_string_input(stdscr, curses.LINES - 1, next_prompt, is_password=True)
                 needs_redraw.set()
 
             # Send the password
@@ -848,25 +1130,31 @@ def attempt_connection(stdscr, ip, port, server_pw_saved, username_saved, user_p
 
 
         # 4. Check Final Login/Registration Response
-        final_response_bytes = sock.recv(1024)
+        final_response_bytes = recv_prompt(sock, handshake_buffer)
         if not final_response_bytes: raise ConnectionAbortedError("Server closed connection after password/registration submission.")
-        final_response = final_response_bytes.decode("utf-8", errors='replace').strip()
+        final_response = decode_prompt(final_response_bytes)
 
-        # Check for either success message
-        if "Login successful" not in final_response and "Registration successful" not in final_response:
+        # Check for either success message (the response is one ANSI-free line, so a prefix test suffices)
+        is_login = final_response.startswith("Login successful")
+        is_registration = not is_login and final_response.startswith("Registration successful")
+        if not (is_login or is_registration):
             # Clean up the server response message for display
-            cleaned_response = strip_ansi_codes(final_response).replace('\n', ' ').strip()
+            cleaned_response = final_response.replace('\n', ' ').strip()
             raise ConnectionAbortedError(f"Login/Registration Failed: {cleaned_response}")
 
         # --- Login or Registration Successful ---
         CURRENT_USER = temp_username # Set global username NOW
-        success_message = "Login successful" if "Login successful" in final_response else "Registration successful"
+        success_message = "Login successful" if is_login else "Registration successful"
         add_message(f"{success_message}. Welcome {CURRENT_USER}!", 4, play_sound=False)
 
         # Save session details (always save on successful login/registration)
         # Use password_used_for_auth which was set in the appropriate path above
         save_session(ip, port, temp_server_pw, temp_username, password_used_for_auth)
 
+        # Chat data that arrived together with the final response goes to the receiver thread
+        handshake_leftover = bytes(handshake_buffer)
+
+        sock.settimeout(None) # Logged in: switch to blocking for the receiver thread
         needs_redraw.set()
         return sock # Return the connected and authenticated socket
 
@@ -898,6 +1186,10 @@ def attempt_connection(stdscr, ip, port, server_pw_saved, username_saved, user_p
                 curses.curs_set(0)
             except: pass
         return None # Indicate failure
+    finally:
+        if stdscr:
+            try: curses.doupdate() # Single flush of everything staged during the attempt
+            except: pass
 
 
 # --- MODIFIED client_main (to handle reconnect prompt logic) ---
@@ -905,11 +1197,14 @@ def attempt_connection(stdscr, ip, port, server_pw_saved, username_saved, user_p
 def client_main(stdscr):
     """The main function orchestrating the TUI client."""
     global client_socket, CURRENT_USER, messages, _intentional_exit, needs_redraw, waiting_for_reconnect_ack
+    global _pending_redraw_messages, _last_beep_time, _system_message_count
 
     # Reset global state variables at the start of execution
     _intentional_exit = False
     waiting_for_reconnect_ack = False # Reset reconnect prompt flag
-    messages.clear() # Clear messages from previous runs
+    with _history_lock:
+        messages.clear() # Clear messages from previous runs
+        _system_message_count = 0
     CURRENT_USER = ""
     client_socket = None
 
@@ -936,20 +1231,23 @@ def client_main(stdscr):
     stdscr.clear()
     if session:
         try:
-            # Display saved session info
-            stdscr.addstr(0, 0, "Found saved session:\n")
-            stdscr.addstr(f"  IP: {session.get('server_ip', 'N/A')}\n")
-            stdscr.addstr(f"  Port: {session.get('server_port', 'N/A')}\n")
-            stdscr.addstr(f"  Server PW Saved: {'Yes' if session.get('server_password') else 'No'}\n")
-            stdscr.addstr(f"  Username: {session.get('username', 'N/A')}\n")
-            stdscr.addstr(f"  User PW Saved: {'Yes' if session.get('user_password') is not None else 'No'}\n")
-            stdscr.addstr("\nUse this session? (y/n): ")
+            # Display saved session info (built as one block, written with a single addstr)
+            session_block = (
+                "Found saved session:\n"
+                f"  IP: {session.get('server_ip', 'N/A')}\n"
+                f"  Port: {session.get('server_port', 'N/A')}\n"
+                f"  Server PW Saved: {'Yes' if session.get('server_password') else 'No'}\n"
+                f"  Username: {session.get('username', 'N/A')}\n"
+                f"  User PW Saved: {'Yes' if session.get('user_password') is not None else 'No'}\n"
+                "\nUse this session? (y/n): "
+            )
+            stdscr.addstr(0, 0, session_block)
 
             curses.echo(); curses.curs_set(1); stdscr.refresh()
 
             while True:
                 key = stdscr.getch() # Blocking call
-                if key in (ord('y'), ord('Y')):
+                if key in KEYS_YES:
                     initially_used_session = True
                     server_ip = session.get('server_ip', "")
                     server_port = session.get('server_port', 0)
@@ -957,7 +1255,7 @@ def client_main(stdscr):
                     username = session.get('username', "")
                     user_password = session.get('user_password')
                     break
-                elif key in (ord('n'), ord('N')):
+                elif key in KEYS_NO:
                     initially_used_session = False
                     break
 
@@ -1014,6 +1312,7 @@ def client_main(stdscr):
             temp_chat = curses.newwin(temp_chat_h, max_x, 0, 0)
             temp_chat.scrollok(True)
             redraw_chat(temp_chat, 0) # Draw messages collected so far
+            curses.doupdate()
             stdscr.addstr(max_y - 1, 0, "Connection failed. Press any key to exit.")
         except curses.error: pass
 
@@ -1025,9 +1324,18 @@ def client_main(stdscr):
 
     # --- Setup Main UI Windows ---
     curses.curs_set(1) # Show cursor in input window
+    curses.typeahead(-1) # Don't interrupt screen updates to poll for pending keystrokes
     curses.noecho()    # Ensure echo is off for main input
     stdscr.nodelay(True) # Set non-blocking input for the main loop
-    stdscr.timeout(INPUT_TIMEOUT) # Check for input every INPUT_TIMEOUT ms
+    # Waiting happens in a selector on stdin + the redraw wake pipe; getch() itself never blocks
+    input_timeout = 0 if USE_SELECT_WAIT else INPUT_TIMEOUT
+    stdscr.timeout(input_timeout)
+    input_selector = None
+    if USE_SELECT_WAIT:
+        # Registered once (epoll/kqueue where available) instead of rebuilding fd sets every wait
+        input_selector = selectors.DefaultSelector()
+        input_selector.register(sys.stdin, selectors.EVENT_READ)
+        input_selector.register(needs_redraw.wake_r, selectors.EVENT_READ)
 
     max_y, max_x = stdscr.getmaxyx()
     try:
@@ -1036,7 +1344,7 @@ def client_main(stdscr):
         print(f"Terminal too small for UI: {e}. Please resize.", file=sys.stderr)
         if client_socket:
             _intentional_exit = True
-            try: client_socket.sendall(b"/exit")
+            try: client_socket.sendall(b"/exit\n")
             except: pass
             try: client_socket.close()
             except: pass
@@ -1044,28 +1352,31 @@ def client_main(stdscr):
         return # Exit client_main
 
     # --- Start Receiver Thread ---
-    receiver = threading.Thread(target=receive_messages_thread, args=(client_socket,), daemon=True)
+    receiver = threading.Thread(target=receive_messages_thread, args=(client_socket, handshake_leftover), daemon=True)
     receiver.start()
 
     # --- Main Event Loop ---
-    current_input = ""
+    current_input = bytearray() # Raw typed bytes; appended in O(1) and decoded on Enter
     scroll_pos = 0 # 0 means scrolled to the bottom
     running = True
     needs_redraw.set() # Trigger initial draw of the UI
 
     while running:
         # --- Redrawing ---
+        if _pending_redraw_messages and not needs_redraw.is_set():
+            needs_redraw.set() # Flush messages whose wakeup add_message throttled
         if needs_redraw.is_set():
             needs_redraw.clear()
-            stdscr.clearok(True)
-            stdscr.clear()
+            with _history_lock: _pending_redraw_messages = 0
 
             try:
-                # Redraw all windows
+                # Redraw the windows; chat and status skip themselves when unchanged,
+                # so only the regions that actually changed are written out
                 redraw_status(status_win)
                 redraw_chat(chat_win, scroll_pos)
                 # Redraw input MUST come last to position cursor correctly
                 redraw_input(input_win, current_input)
+                curses.doupdate() # Write all staged window changes to the terminal at once
             except curses.error:
                 # Attempt to resize UI components
                 new_windows = resize_ui(stdscr, chat_win, input_win, status_win)
@@ -1078,14 +1389,20 @@ def client_main(stdscr):
                     print("Terminal too small, exiting.", file=sys.stderr)
                 continue # Restart loop after resize attempt
 
-            stdscr.clearok(False)
             # Cursor positioning is now handled within redraw_input
 
 
         # --- Input Handling ---
         try:
-            input_win.timeout(INPUT_TIMEOUT) # Ensure timeout is set for the input window
+            input_win.timeout(input_timeout) # Ensure timeout is set for the input window
             key = input_win.getch()
+            if key == -1 and input_selector and not needs_redraw.is_set():
+                # Nothing buffered: sleep until a key arrives or another thread requests a redraw.
+                # Throttled messages need a flush soon; otherwise only wake up now and then.
+                wait = REDRAW_MIN_INTERVAL if _pending_redraw_messages else IDLE_WAKEUP_INTERVAL
+                input_selector.select(wait)
+                needs_redraw.drain()
+                key = input_win.getch()
         except curses.error: # Error getting input, maybe terminal closed/unusable?
             running = False
             _intentional_exit = True
@@ -1107,7 +1424,7 @@ def client_main(stdscr):
 
             # Set flag to wait for user input 'y' or 'n'
             waiting_for_reconnect_ack = True
-            current_input = "" # Clear any partial user input
+            current_input = bytearray() # Clear any partial user input
             needs_redraw.set() # Trigger redraw to show the prompt
             continue # Skip normal input processing, wait for y/n
 
@@ -1120,13 +1437,13 @@ def client_main(stdscr):
 
         # --- Handle Input WHILE waiting for reconnect confirmation ---
         if waiting_for_reconnect_ack:
-            if key in (ord('y'), ord('Y')):
+            if key in KEYS_YES:
                 waiting_for_reconnect_ack = False # Reset flag
                 add_message("Attempting reconnection...", 6, play_sound=False)
                 needs_redraw.set() # Show the "Attempting..." message
 
-                # Need current session data for reconnection
-                current_session = load_session()
+                # Need current session data for reconnection (in memory since the last login)
+                current_session = _last_session or load_session()
                 if current_session:
                     reconnect_ip = current_session.get('server_ip')
                     reconnect_port = current_session.get('server_port')
@@ -1149,7 +1466,7 @@ def client_main(stdscr):
                     add_message("Reconnected successfully!", 4, play_sound=True)
                     _intentional_exit = False # Reset flag
                     # Start new receiver thread
-                    receiver = threading.Thread(target=receive_messages_thread, args=(client_socket,), daemon=True)
+                    receiver = threading.Thread(target=receive_messages_thread, args=(client_socket, handshake_leftover), daemon=True)
                     receiver.start()
                 else:
                     # Reconnection failed
@@ -1159,7 +1476,7 @@ def client_main(stdscr):
 
                 needs_redraw.set() # Redraw UI
 
-            elif key in (ord('n'), ord('N')):
+            elif key in KEYS_NO:
                 waiting_for_reconnect_ack = False # Reset flag
                 add_message("Not reconnecting. Exiting.", 6, play_sound=False)
                 running = False # Exit main loop
@@ -1167,10 +1484,12 @@ def client_main(stdscr):
                 needs_redraw.set() # Redraw UI
 
             else:
-                # Ignore other keys while waiting for y/n
-                # Optional: add a small bell/flash?
-                curses.beep()
-                pass
+                # Ignore other keys while waiting for y/n, with a bell at most every BEEP_MIN_INTERVAL
+                # so held-down keys can't flood the terminal with (possibly visual) bells
+                now = time.monotonic()
+                if now - _last_beep_time > BEEP_MIN_INTERVAL:
+                    _last_beep_time = now
+                    curses.beep()
             # After handling y/n or ignoring other keys, continue to next loop iteration
             continue
 
@@ -1185,13 +1504,17 @@ def client_main(stdscr):
                 print("Terminal too small after resize, exiting.", file=sys.stderr)
             continue # Restart loop after resize attempt
 
-        elif key in (curses.KEY_BACKSPACE, 127, 8): # Handle various backspace keys
-            current_input = current_input[:-1]
+        elif key in KEYS_BACKSPACE: # Handle various backspace keys
+            # Remove the last character: any UTF-8 continuation bytes, then its lead byte
+            while current_input and current_input[-1] & 0xC0 == 0x80:
+                del current_input[-1]
+            if current_input: del current_input[-1]
             redraw_input(input_win, current_input) # Redraw only input needed
+            curses.doupdate()
 
-        elif key in (curses.KEY_ENTER, 10, 13): # Handle various enter keys
-            input_to_send = current_input.strip()
-            current_input = "" # Clear input buffer immediately
+        elif key in KEYS_ENTER: # Handle various enter keys
+            input_to_send = current_input.decode("utf-8", errors="replace").strip() # Decode once per line
+            current_input = bytearray() # Clear input buffer immediately
             scroll_pos = 0 # Scroll to bottom after sending
             # redraw_input is handled by needs_redraw.set() below
 
@@ -1205,11 +1528,10 @@ def client_main(stdscr):
         elif key == curses.KEY_PPAGE: # Page Up
             chat_h = chat_win.getmaxyx()[0]
             scroll_amount = max(1, chat_h - 3)
-            with message_lock:
-                # Calculate effective number of lines (consider wrapping later if needed)
-                # For now, assume 1 message = 1 line for scroll calculation simplicity
-                visible_lines = max(1, chat_h - 2)
-                max_scroll = max(0, len(messages) - visible_lines)
+            # Calculate effective number of lines (consider wrapping later if needed)
+            # For now, assume 1 message = 1 line for scroll calculation simplicity
+            visible_lines = max(1, chat_h - 2)
+            max_scroll = max(0, len(messages) - visible_lines)
             scroll_pos = min(scroll_pos + scroll_amount, max_scroll)
             needs_redraw.set()
 
@@ -1221,16 +1543,24 @@ def client_main(stdscr):
 
         elif 32 <= key <= 255: # Printable characters (Basic ASCII range)
              if len(current_input) < MAX_LENGHT + 50: # Allow some buffer over limit
-                 try:
-                     current_input += chr(key)
-                     redraw_input(input_win, current_input) # Redraw only input window
-                 except ValueError:
-                     pass # Ignore invalid chars
+                 current_input.append(key) # Terminal bytes; multi-byte UTF-8 chars arrive one byte per key
+                 # Consume any further printable keys already waiting (fast typing, pastes)
+                 # so the whole burst costs a single input redraw
+                 input_win.timeout(0)
+                 while len(current_input) < MAX_LENGHT + 50:
+                     next_key = input_win.getch()
+                     if not 32 <= next_key <= 255:
+                         if next_key != -1: curses.ungetch(next_key) # Leave it for the main loop
+                         break
+                     current_input.append(next_key)
+                 redraw_input(input_win, current_input) # Redraw only input window
+                 curses.doupdate()
 
         # Ignore other special keys for now
 
     # --- End of Main Loop ---
     # This block runs when running becomes False
+    if input_selector: input_selector.close()
 
     # Final redraw attempt to show disconnection messages before exit
     if needs_redraw.is_set() or not _intentional_exit:
@@ -1238,6 +1568,7 @@ def client_main(stdscr):
            # If exiting due to loop end without explicit /exit or Ctrl+C
            # and not already waiting for reconnect prompt (which means failure occurred)
             add_message("Disconnecting...", 6, play_sound=False)
+       needs_redraw.wait(timeout=0.1) # Give the receiver a brief chance to deliver last messages
        try:
            # Ensure cursor is hidden on final draw
            curses.curs_set(0)
@@ -1250,13 +1581,18 @@ def client_main(stdscr):
                input_win.erase()
                input_win.border()
                input_win.refresh()
-           stdscr.refresh()
+           stdscr.refresh() # Single final flush
        except: pass
-       time.sleep(0.5) # Short pause to see final state
 
 
 # --- Signal Handler & Exit Cleanup ---
 
+def close_socket(sock):
+    """Shuts down and closes a socket; safe to call on one that is already closed."""
+    try: sock.shutdown(socket.SHUT_RDWR)
+    except OSError: pass # Not connected (any more)
+    sock.close() # No-op if the socket object was already closed
+
 def graceful_exit_handler(signum, frame):
     """Attempts to gracefully close the connection on SIGINT (Ctrl+C)."""
     global client_socket, _exiting_gracefully, _intentional_exit
@@ -1276,7 +1612,6 @@ def graceful_exit_handler(signum, frame):
                 curses.movestr(max_y -1, 0, "Ctrl+C detected. Exiting...")
                 curses.refresh()
             except: pass # Ignore errors if curses is unusable
-            time.sleep(0.2) # Short delay
         else:
             print("\nCtrl+C detected. Exiting...", file=sys.stderr) # Fallback print
     except:
@@ -1287,13 +1622,9 @@ def graceful_exit_handler(signum, frame):
 
     if sock_to_close:
         try:
-            sock_to_close.sendall("/exit".encode("utf-8"))
-            time.sleep(0.1) # Give server a moment
-        except: pass
-        try: sock_to_close.shutdown(socket.SHUT_RDWR)
-        except: pass
-        try: sock_to_close.close()
+            sock_to_close.sendall(b"/exit\n") # Queued in the kernel; close_socket's shutdown still delivers it before FIN
         except: pass
+        close_socket(sock_to_close)
 
     # Explicitly call cleanup registered with atexit, as signal might bypass normal exit
     cleanup()
@@ -1335,15 +1666,9 @@ def cleanup():
 
     # --- Close socket if still open ---
     sock = client_socket
-    if sock:
-        # print("Attempting socket close in cleanup...", file=sys.stderr) # Optional debug
-        try: sock.shutdown(socket.SHUT_RDWR)
-        except: pass
-        try:
-            sock.close()
-            client_socket = None
-            # print("Socket closed by cleanup.", file=sys.stderr) # Optional debug
-        except: pass
+    if sock: # Already None when graceful_exit_handler closed it
+        client_socket = None
+        close_socket(sock)
     # print("Client cleanup finished.") # Final message after cleanup
 
 # --- Entry Point ---